@@ -1,6 +1,7 @@
 """A command parser class."""
 
-import textwrap
+import random
+import time
 from typing import Sequence
 
 
@@ -9,11 +10,162 @@ class CommandException(Exception):
     pass
 
 
+class CommandSpec:
+    """A class used to describe a command: its handler, arguments and help."""
+
+    def __init__(self, name, handler, description, arguments="",
+                 arities=None, error=None):
+        """CommandSpec constructor.
+        Args:
+            name: The upper case command verb.
+            handler: The name of the VideoPlayer method running the command.
+            description: The help text of the command.
+            arguments: The argument placeholders shown in the help.
+            arities: The accepted numbers of arguments, None to accept any.
+            error: The message of the CommandException raised for any other
+                number of arguments.
+        """
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.arguments = arguments
+        self.arities = arities
+        self.error = error
+
+    @property
+    def usage(self):
+        """Returns the command as shown in the help."""
+        return f"{self.name} {self.arguments}" if self.arguments else self.name
+
+
+# Every command, in the order the help lists them. EXIT has no handler, it is
+# handled by the main loop.
+COMMANDS = [
+    CommandSpec("NUMBER_OF_VIDEOS", "number_of_videos",
+                "Shows how many videos are in the library."),
+    CommandSpec("SHOW_ALL_VIDEOS", "show_all_videos",
+                "Lists all videos from the library."),
+    CommandSpec("PLAY", "play_video", "Plays specified video.",
+                "<video_id>", (1,),
+                "Please enter PLAY command followed by video_id."),
+    CommandSpec("PLAY_RANDOM", "play_random_video",
+                "Plays a random video from the library, drawn by video weight "
+                "with WEIGHTED, or the next video of a non-repeating shuffle "
+                "of a playlist with SHUFFLE.",
+                "[WEIGHTED | SHUFFLE <playlist_name>]", (0, 1, 2),
+                "Please enter PLAY_RANDOM command, optionally followed by "
+                "WEIGHTED or by SHUFFLE and a playlist name."),
+    CommandSpec("STOP", "stop_video", "Stop the current video."),
+    CommandSpec("PAUSE", "pause_video", "Pause the current video."),
+    CommandSpec("CONTINUE", "continue_video",
+                "Resume the current paused video."),
+    CommandSpec("SHOW_PLAYING", "show_playing",
+                "Displays the title, url and paused status of the video that "
+                "is currently playing (or paused)."),
+    CommandSpec("CREATE_PLAYLIST", "create_playlist",
+                "Creates a new (empty) playlist with the provided name.",
+                "<playlist_name>", (1,),
+                "Please enter CREATE_PLAYLIST command followed by a "
+                "playlist name."),
+    CommandSpec("ADD_TO_PLAYLIST", "add_to_playlist",
+                "Adds the requested video to the playlist.",
+                "<playlist_name> <video_id>", (2,),
+                "Please enter ADD_TO_PLAYLIST command followed by a "
+                "playlist name and video_id to add."),
+    CommandSpec("REMOVE_FROM_PLAYLIST", "remove_from_playlist",
+                "Removes the specified video from the specified playlist",
+                "<playlist_name> <video_id>", (2,),
+                "Please enter REMOVE_FROM_PLAYLIST command followed by a "
+                "playlist name and video_id to remove."),
+    CommandSpec("CLEAR_PLAYLIST", "clear_playlist",
+                "Removes all the videos from the playlist.",
+                "<playlist_name>", (1,),
+                "Please enter CLEAR_PLAYLIST command followed by a "
+                "playlist name."),
+    CommandSpec("DELETE_PLAYLIST", "delete_playlist", "Deletes the playlist.",
+                "<playlist_name>", (1,),
+                "Please enter DELETE_PLAYLIST command followed by a "
+                "playlist name."),
+    CommandSpec("SHOW_PLAYLIST", "show_playlist",
+                "List all the videos in this playlist.",
+                "<playlist_name>", (1,),
+                "Please enter SHOW_PLAYLIST command followed by a "
+                "playlist name."),
+    CommandSpec("SHOW_ALL_PLAYLISTS", "show_all_playlists",
+                "Display all the available playlists."),
+    CommandSpec("SEARCH_VIDEOS", "search_videos",
+                "Display all the videos whose titles contain the search_term.",
+                "<search_term> [<limit> [<offset>]]", (1, 2, 3),
+                "Please enter SEARCH_VIDEOS command followed by a "
+                "search term and optionally a page size and offset."),
+    CommandSpec("FUZZY_SEARCH_VIDEOS", "fuzzy_search_videos",
+                "Display the videos whose titles contain the search_term, "
+                "allowing for typos.",
+                "<search_term> [<limit> [<offset>]]", (1, 2, 3),
+                "Please enter FUZZY_SEARCH_VIDEOS command followed by a "
+                "search term and optionally a page size and offset."),
+    CommandSpec("SEARCH_VIDEOS_WITH_TAG", "search_videos_tag",
+                "Display all videos whose tags contains the provided tag.",
+                "<tag_name> [<limit> [<offset>]]", (1, 2, 3),
+                "Please enter SEARCH_VIDEOS_WITH_TAG command followed by a "
+                "video tag and optionally a page size and offset."),
+    CommandSpec("COMPLETE", "complete",
+                "Lists the video_ids, video titles and playlist names "
+                "starting with the prefix.",
+                "<prefix> [<limit>]", (1, 2),
+                "Please enter COMPLETE command followed by a prefix and "
+                "optionally the number of completions."),
+    CommandSpec("FLAG_VIDEO", "flag_video", "Mark a video as flagged.",
+                "<video_id> <flag_reason>", (1, 2),
+                "Please enter FLAG_VIDEO command followed by a "
+                "video_id and an optional flag reason."),
+    CommandSpec("ALLOW_VIDEO", "allow_video", "Removes a flag from a video.",
+                "<video_id>", (1,),
+                "Please enter ALLOW_VIDEO command followed by a "
+                "video_id."),
+    CommandSpec("HELP", "_get_help", "Displays help."),
+    CommandSpec("EXIT", None, "Terminates the program execution."),
+]
+
+
+def benchmark_dispatch(commands=1_000_000):
+    """Prints how many commands per second CommandParser dispatches.
+    The trace mixes every command except HELP and EXIT, using each one's
+    largest accepted number of arguments. The player does nothing, so only
+    parsing and dispatch are measured.
+    """
+
+    class NullPlayer:
+        def __getattr__(self, name):
+            return lambda *args: None
+
+    verbs = [spec for spec in COMMANDS if spec.name not in ("HELP", "EXIT")]
+    samples = [[spec.name.lower()] + ["arg"] * max(spec.arities or (0,))
+               for spec in verbs]
+    rng = random.Random(0)
+    trace = [rng.choice(samples) for _ in range(commands)]
+    parser = CommandParser(NullPlayer())
+    start = time.perf_counter()
+    for command in trace:
+        parser.execute_command(command)
+    elapsed = time.perf_counter() - start
+    print(f"{commands} commands in {elapsed:.2f}s: "
+          f"{commands / elapsed:,.0f} commands/s")
+
+
 class CommandParser:
     """A class used to parse and execute a user Command."""
 
     def __init__(self, video_player):
         self._player = video_player
+        # Bind every handler once so that dispatching is a single dict lookup.
+        self._dispatch = {}
+        for spec in COMMANDS:
+            if spec.handler is None:
+                continue
+            target = self if spec.handler == "_get_help" else video_player
+            self._dispatch[spec.name] = (
+                getattr(target, spec.handler), spec.arities, spec.error)
 
     def execute_command(self, command: Sequence[str]):
         """Executes the user command. Expects the command to be upper case.
@@ -24,153 +176,337 @@ class CommandParser:
                 "Please enter a valid command, "
                 "type HELP for a list of available commands.")
 
-        if command[0].upper() == "NUMBER_OF_VIDEOS":
-            self._player.number_of_videos()
-
-        elif command[0].upper() == "SHOW_ALL_VIDEOS":
-            self._player.show_all_videos()
-
-        elif command[0].upper() == "PLAY":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter PLAY command followed by video_id.")
-            self._player.play_video(command[1])
-
-        elif command[0].upper() == "PLAY_RANDOM":
-            self._player.play_random_video()
-
-        elif command[0].upper() == "STOP":
-            self._player.stop_video()
-
-        elif command[0].upper() == "PAUSE":
-            self._player.pause_video()
-
-        elif command[0].upper() == "CONTINUE":
-            self._player.continue_video()
-
-        elif command[0].upper() == "SHOW_PLAYING":
-            self._player.show_playing()
-
-        elif command[0].upper() == "CREATE_PLAYLIST":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter CREATE_PLAYLIST command followed by a "
-                    "playlist name.")
-            self._player.create_playlist(command[1])
-
-        elif command[0].upper() == "ADD_TO_PLAYLIST":
-            if len(command) != 3:
-                raise CommandException(
-                    "Please enter ADD_TO_PLAYLIST command followed by a "
-                    "playlist name and video_id to add.")
-            self._player.add_to_playlist(command[1], command[2])
-
-        elif command[0].upper() == "REMOVE_FROM_PLAYLIST":
-            if len(command) != 3:
-                raise CommandException(
-                    "Please enter REMOVE_FROM_PLAYLIST command followed by a "
-                    "playlist name and video_id to remove.")
-            self._player.remove_from_playlist(command[1], command[2])
-
-        elif command[0].upper() == "CLEAR_PLAYLIST":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter CLEAR_PLAYLIST command followed by a "
-                    "playlist name.")
-            self._player.clear_playlist(command[1])
-
-        elif command[0].upper() == "DELETE_PLAYLIST":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter DELETE_PLAYLIST command followed by a "
-                    "playlist name.")
-            self._player.delete_playlist(command[1])
-
-        elif command[0].upper() == "SHOW_PLAYLIST":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter SHOW_PLAYLIST command followed by a "
-                    "playlist name.")
-            self._player.show_playlist(command[1])
-
-        elif command[0].upper() == "SHOW_ALL_PLAYLISTS":
-            self._player.show_all_playlists()
-
-        elif command[0].upper() == "SEARCH_VIDEOS":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter SEARCH_VIDEOS command followed by a "
-                    "search term.")
-            self._player.search_videos(command[1])
-
-        elif command[0].upper() == "SEARCH_VIDEOS_WITH_TAG":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter SEARCH_VIDEOS_WITH_TAG command followed by a "
-                    "video tag.")
-            self._player.search_videos_tag(command[1])
-
-        elif command[0].upper() == "FLAG_VIDEO":
-            if len(command) == 3:
-                self._player.flag_video(command[1], command[2])
-            elif len(command) == 2:
-                self._player.flag_video(command[1])
-            else:
-                raise CommandException(
-                    "Please enter FLAG_VIDEO command followed by a "
-                    "video_id and an optional flag reason.")
-
-        elif command[0].upper() == "ALLOW_VIDEO":
-            if len(command) != 2:
-                raise CommandException(
-                    "Please enter ALLOW_VIDEO command followed by a "
-                    "video_id.")
-            self._player.allow_video(command[1])
-
-        elif command[0].upper() == "HELP":
-            self._get_help()
-        else:
+        entry = self._dispatch.get(command[0].upper())
+        if entry is None:
             print(
                 "Please enter a valid command, type HELP for a list of "
                 "available commands.")
+            return
+        handler, arities, error = entry
+        arguments = command[1:]
+        if arities is None:
+            handler()
+        elif len(arguments) in arities:
+            handler(*arguments)
+        else:
+            raise CommandException(error)
 
     def _get_help(self):
         """Displays all available commands to the user."""
-        help_text = textwrap.dedent("""
-        Available commands:
-            NUMBER_OF_VIDEOS - Shows how many videos are in the library.
-            SHOW_ALL_VIDEOS - Lists all videos from the library.
-            PLAY <video_id> - Plays specified video.
-            PLAY_RANDOM - Plays a random video from the library.
-            STOP - Stop the current video.
-            PAUSE - Pause the current video.
-            CONTINUE - Resume the current paused video.
-            SHOW_PLAYING - Displays the title, url and paused status of the video that is currently playing (or paused).
-            CREATE_PLAYLIST <playlist_name> - Creates a new (empty) playlist with the provided name.
-            ADD_TO_PLAYLIST <playlist_name> <video_id> - Adds the requested video to the playlist.
-            REMOVE_FROM_PLAYLIST <playlist_name> <video_id> - Removes the specified video from the specified playlist
-            CLEAR_PLAYLIST <playlist_name> - Removes all the videos from the playlist.
-            DELETE_PLAYLIST <playlist_name> - Deletes the playlist.
-            SHOW_PLAYLIST <playlist_name> - List all the videos in this playlist.
-            SHOW_ALL_PLAYLISTS - Display all the available playlists.
-            SEARCH_VIDEOS <search_term> - Display all the videos whose titles contain the search_term.
-            SEARCH_VIDEOS_WITH_TAG <tag_name> -Display all videos whose tags contains the provided tag.
-            FLAG_VIDEO <video_id> <flag_reason> - Mark a video as flagged.
-            ALLOW_VIDEO <video_id> - Removes a flag from a video.
-            HELP - Displays help.
-            EXIT - Terminates the program execution.
-        """)
+        help_text = "\n".join(
+            ["", "Available commands:"]
+            + [f"    {spec.usage} - {spec.description}" for spec in COMMANDS]
+            + [""])
         print(help_text)
         """A youtube terminal simulator."""
-        from .video_player import VideoPlayer
-        from .command_parser import CommandException
+        import argparse
+        import asyncio
+        import contextlib
+        import functools
+        import io
+        import os
+        import random
+        import sys
+        import tempfile
+        import time
+        from .video_library import ShardedVideoLibrary, VideoLibrary
+        from .video_player import PlayerStore, VideoPlayer
+        from .command_parser import COMMANDS, CommandException
         from .command_parser import CommandParser
 
+        # Size of the output buffer in batch mode; output is written in blocks
+        # of this size instead of once per printed line.
+        _BATCH_BUFFER_SIZE = 1 << 20
+
+        def run_batch(command_file, video_player):
+            """Executes every command of command_file without prompting.
+            Lines are handled exactly as if typed at the prompt, up to an EXIT line
+            or the end of the file. Answers to the "play any of the above?"
+            question are read from the line following the search command; a
+            search on the last line is answered no.
+            Output is buffered and the throughput is reported on stderr. A player
+            created with defer_answers gets its answers through answer_search, so
+            searches do not flush the buffer waiting for input().
+            Args:
+                command_file: A text file with one command per line.
+                video_player: The VideoPlayer running the commands.
+            """
+            parser = CommandParser(video_player)
+            sys.stdout.flush()
+            output = open(sys.stdout.fileno(), "w", buffering=_BATCH_BUFFER_SIZE,
+                          closefd=False)
+            commands = 0
+            start = time.perf_counter()
+            saved_stdin, sys.stdin = sys.stdin, command_file
+            try:
+                with output, contextlib.redirect_stdout(output):
+                    for line in command_file:
+                        if video_player.awaiting_answer():
+                            video_player.answer_search(line.strip())
+                            continue
+                        command = line.split()
+                        if command and command[0].upper() == "EXIT":
+                            break
+                        commands += 1
+                        try:
+                            parser.execute_command(command)
+                        except CommandException as e:
+                            print(e)
+            finally:
+                sys.stdin = saved_stdin
+            elapsed = time.perf_counter() - start
+            print(f"Executed {commands} commands in {elapsed:.2f}s "
+                  f"({commands / elapsed if elapsed else 0:,.0f} commands/s)",
+                  file=sys.stderr)
+
+        # Sent after every response of the command server, so clients know where a
+        # response ends.
+        _PROMPT = "YT> "
+
+        def _run_server_command(parser, video_player, line):
+            """Executes one line received by the command server.
+            Everything printed, by the parser or the player, is captured. The line
+            answers the pending search question instead, if there is one.
+            Returns:
+                The command's output.
+            """
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                if video_player.awaiting_answer():
+                    video_player.answer_search(line.strip())
+                else:
+                    try:
+                        parser.execute_command(line.split())
+                    except CommandException as e:
+                        print(e)
+            return output.getvalue()
+
+        async def _serve_connection(video_library, reader, writer):
+            """Runs one client's session: its own player over the shared library."""
+            video_player = VideoPlayer(video_library, defer_answers=True,
+                                       session_flags=True)
+            parser = CommandParser(video_player)
+            writer.write(("Hello and welcome to YouTube, what would you like to do?\n"
+                          "Enter HELP for list of available commands or EXIT to "
+                          "terminate.\n" + _PROMPT).encode())
+            try:
+                while line := (await reader.readline()).decode():
+                    if (line.strip().upper() == "EXIT"
+                            and not video_player.awaiting_answer()):
+                        writer.write(b"YouTube has now terminated its execution. "
+                                     b"Thank you and goodbye!\n")
+                        break
+                    writer.write(
+                        (_run_server_command(parser, video_player, line)
+                         + _PROMPT).encode())
+                    await writer.drain()
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                video_player.close()
+                writer.close()
+
+        async def _start_server(address, video_library):
+            """Starts serving address: "host:port" for TCP, otherwise the path of a
+            Unix socket.
+            """
+            handler = functools.partial(_serve_connection, video_library)
+            host, _, port = address.rpartition(":")
+            if port.isdigit():
+                return await asyncio.start_server(handler, host or "localhost",
+                                                  int(port), backlog=4096)
+            return await asyncio.start_unix_server(handler, address, backlog=4096)
+
+        async def serve(address, video_library=None):
+            """Serves the command line protocol until cancelled.
+            Clients send one command per line, as typed at the prompt, and get back
+            its output followed by the prompt. Every connection has its own
+            VideoPlayer, so playback, playlists and flags are per connection, while
+            all of them share one VideoLibrary that is never reloaded or changed:
+            FLAG_VIDEO and ALLOW_VIDEO only change what their own connection sees.
+            Args:
+                address: "host:port" for TCP, or the path of a Unix socket.
+                video_library: The library to share, VideoLibrary.shared() if None.
+            """
+            if video_library is None:
+                video_library = VideoLibrary.shared()
+            server = await _start_server(address, video_library)
+            async with server:
+                await server.serve_forever()
+
+        async def _load_client(address, commands, latencies):
+            """Sends the commands one at a time, timing each response."""
+            prompt = _PROMPT.encode()
+            host, _, port = address.rpartition(":")
+            if port.isdigit():
+                reader, writer = await asyncio.open_connection(host or "localhost",
+                                                               int(port))
+            else:
+                reader, writer = await asyncio.open_unix_connection(address)
+            await reader.readuntil(prompt)
+            for command in commands:
+                start = time.perf_counter()
+                writer.write(command.encode() + b"\n")
+                await reader.readuntil(prompt)
+                latencies.append(time.perf_counter() - start)
+            writer.write(b"EXIT\n")
+            await reader.read()
+            writer.close()
+
+        def run_load_test(address=None, connections=2000, commands_per_connection=20):
+            """Prints the command latency and throughput of many concurrent clients.
+            Every client opens its own connection and sends a mix of listing,
+            playback, playlist and search commands, waiting for each response
+            before sending the next command.
+            Args:
+                address: The server to load, as for serve. None to start one on a
+                    temporary Unix socket in this process.
+                connections: The number of concurrent clients.
+                commands_per_connection: The number of commands each client sends.
+            """
+            try:
+                import resource
+            except ImportError:
+                # No open file limit to raise, as on Windows.
+                resource = None
+            if resource is not None:
+                limits = soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+                # Each connection needs a file descriptor, two if the server runs here.
+                wanted = 2 * connections + 64
+                if hard != resource.RLIM_INFINITY:
+                    wanted = min(wanted, hard)
+                if soft != resource.RLIM_INFINITY and soft < wanted:
+                    resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+            video_library = VideoLibrary.shared()
+            video_ids = [video.video_id for video in video_library.get_videos(limit=100)]
+            rng = random.Random(0)
+
+            def commands():
+                video_id = rng.choice(video_ids)
+                mix = ["NUMBER_OF_VIDEOS", "SHOW_ALL_VIDEOS", f"PLAY {video_id}",
+                       "SHOW_PLAYING", "PAUSE", "CREATE_PLAYLIST mine",
+                       f"ADD_TO_PLAYLIST mine {video_id}", "SHOW_PLAYLIST mine",
+                       "SEARCH_VIDEOS_WITH_TAG #cat", "1"]
+                return [mix[number % len(mix)]
+                        for number in range(commands_per_connection)]
+
+            async def load(address):
+                latencies = []
+                start = time.perf_counter()
+                await asyncio.gather(*(_load_client(address, commands(), latencies)
+                                       for _ in range(connections)))
+                return latencies, time.perf_counter() - start
+
+            async def main():
+                if address is not None:
+                    return await load(address)
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, "server.sock")
+                    server = await _start_server(path, video_library)
+                    async with server:
+                        return await load(path)
+
+            try:
+                latencies, elapsed = asyncio.run(main())
+            finally:
+                if resource is not None:
+                    resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+            latencies.sort()
+            print(f"{connections} connections, {len(latencies)} commands in "
+                  f"{elapsed:.2f}s: {len(latencies) / elapsed:,.0f} commands/s, "
+                  f"p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+                  f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+        # Most completions offered for one TAB at the prompt.
+        _TAB_COMPLETIONS = 50
+
+        def _tab_completions(video_player, line, text):
+            """Returns what TAB offers for the word text of the prompt line.
+            The first word completes to a command, later ones to the video_ids
+            and playlist names of VideoPlayer.completions. readline replaces text
+            with the common prefix of the matches, so only values that extend
+            text, ignoring case, are offered.
+            """
+            if line.strip():
+                candidates = [value for _, value in
+                              video_player.completions(text, _TAB_COMPLETIONS)]
+            else:
+                candidates = [spec.name for spec in COMMANDS]
+            return sorted({candidate for candidate in candidates
+                           if candidate.casefold().startswith(text.casefold())})
+
+        def enable_tab_completion(video_player):
+            """Completes commands, video_ids and playlist names on TAB at the
+            prompt. Does nothing where the readline module is not available.
+            """
+            try:
+                import readline
+            except ImportError:
+                return
+            matches = []
+
+            def complete(text, state):
+                if state == 0:
+                    line = readline.get_line_buffer()[:readline.get_begidx()]
+                    matches[:] = _tab_completions(video_player, line, text)
+                return matches[state] if state < len(matches) else None
+
+            readline.set_completer(complete)
+            readline.set_completer_delims(" \t\n")
+            readline.parse_and_bind("tab: complete")
+
         if __name__ == "__main__":
+            argument_parser = argparse.ArgumentParser(description=__doc__)
+            argument_parser.add_argument(
+                "--batch", metavar="FILE", type=argparse.FileType("r"),
+                help="run the commands in FILE ('-' for stdin) without prompts")
+            argument_parser.add_argument(
+                "--state", metavar="DIRECTORY",
+                help="keep playlists, flags and playback state in DIRECTORY across runs")
+            argument_parser.add_argument(
+                "--serve", metavar="ADDRESS",
+                help="serve commands over a socket instead of the prompt, at "
+                     "HOST:PORT or the path of a Unix socket; every connection "
+                     "has its own playback, playlists and flags")
+            argument_parser.add_argument(
+                "--load-test", metavar="ADDRESS", nargs="?", const="",
+                help="measure command latency against the server at ADDRESS, or "
+                     "against one started in this process if ADDRESS is omitted")
+            argument_parser.add_argument(
+                "--connections", type=int, default=2000,
+                help="concurrent clients of --load-test (default: %(default)s)")
+            argument_parser.add_argument(
+                "--shards", metavar="N", type=int,
+                help="partition the library across N worker processes")
+            arguments = argument_parser.parse_args()
+            sharded_library = (ShardedVideoLibrary(arguments.shards)
+                               if arguments.shards else None)
+            if arguments.serve is not None:
+                with contextlib.suppress(KeyboardInterrupt):
+                    asyncio.run(serve(arguments.serve, sharded_library))
+                sys.exit()
+            if arguments.load_test is not None:
+                run_load_test(arguments.load_test or None, arguments.connections)
+                sys.exit()
+            store = PlayerStore(arguments.state) if arguments.state is not None else None
+            if arguments.batch is not None:
+                video_player = VideoPlayer(sharded_library, store=store,
+                                           defer_answers=True)
+                run_batch(arguments.batch, video_player)
+                video_player.close()
+                sys.exit()
             print("""Hello and welcome to YouTube, what would you like to do?
             Enter HELP for list of available commands or EXIT to terminate.""")
-            video_player = VideoPlayer()
+            if sharded_library is not None:
+                video_library = sharded_library
+            else:
+                # Load the catalog in the background so the prompt shows up right away.
+                video_library = VideoLibrary(streaming=True)
+                video_library.watch()
+            video_player = VideoPlayer(video_library, store=store)
             parser = CommandParser(video_player)
+            enable_tab_completion(video_player)
             while True:
                 command = input("YT> ")
                 if command.upper() == "EXIT":
@@ -179,23 +515,78 @@ class CommandParser:
                     parser.execute_command(command.split())
                 except CommandException as e:
                     print(e)
+            video_player.close()
             print("YouTube has now terminated its execution. "
                   "Thank you and goodbye!")
             """A video class."""
 
-            from typing import Sequence
+            import sys
+            import threading
+            from typing import Dict, List, Sequence, Tuple
+
+            class TagVocabulary:
+                """A shared table of the distinct tags used by all videos.
+                Each tag string is stored once and referred to by a small integer id.
+                Tag id tuples are interned as well, so videos with the same tags share
+                one tuple and decode to one shared tuple of strings.
+                Lookups of known tags do not lock; new tags are added under a lock, so
+                videos can be built from several threads.
+                """
+
+                def __init__(self):
+                    self._tag_ids: Dict[str, int] = {}
+                    self._tags: List[str] = []
+                    self._encoded: Dict[Tuple[str, ...], Tuple[int, ...]] = {}
+                    self._decoded: Dict[Tuple[int, ...], Tuple[str, ...]] = {}
+                    self._lock = threading.Lock()
+
+                def __len__(self) -> int:
+                    return len(self._tags)
+
+                def encode(self, tags: Sequence[str]) -> Tuple[int, ...]:
+                    """Returns the interned tuple of tag ids for the given tags."""
+                    tags = tuple(tags)
+                    tag_ids = self._encoded.get(tags)
+                    if tag_ids is None:
+                        with self._lock:
+                            tag_ids = tuple(self._tag_id(tag) for tag in tags)
+                            # Decodable before other threads can find it in _encoded.
+                            self._decoded.setdefault(
+                                tag_ids, tuple(self._tags[tag_id] for tag_id in tag_ids))
+                            tag_ids = self._encoded.setdefault(tags, tag_ids)
+                    return tag_ids
+
+                def decode(self, tag_ids: Tuple[int, ...]) -> Tuple[str, ...]:
+                    """Returns the tuple of tag strings for the given tag ids."""
+                    return self._decoded[tag_ids]
+
+                def _tag_id(self, tag: str) -> int:
+                    """Returns the id of a tag, adding it if it is new. Called with the
+                    lock held, so the id is the position the tag is appended at.
+                    """
+                    tag_id = self._tag_ids.get(tag)
+                    if tag_id is None:
+                        tag_id = len(self._tags)
+                        self._tags.append(sys.intern(tag))
+                        self._tag_ids[tag] = tag_id
+                    return tag_id
+
+            # Vocabulary shared by every Video.
+            TAGS = TagVocabulary()
 
             class Video:
                 """A class used to represent a Video."""
 
+                __slots__ = ("_title", "_video_id", "_tag_ids")
+
                 def __init__(self, video_title: str, video_id: str, video_tags: Sequence[str]):
                     """Video constructor."""
                     self._title = video_title
                     self._video_id = video_id
 
-                    # Turn the tags into a tuple here so it's unmodifiable,
-                    # in case the caller changes the 'video_tags' they passed to us
-                    self._tags = tuple(video_tags)
+                    # Store the tags as interned ids so they are unmodifiable and
+                    # shared, in case the caller changes the 'video_tags' they passed to us
+                    self._tag_ids = TAGS.encode(video_tags)
 
                 @property
                 def title(self) -> str:
@@ -210,39 +601,1496 @@ class CommandParser:
                 @property
                 def tags(self) -> Sequence[str]:
                     """Returns the list of tags of a video."""
-                    return self._tags
+                    return TAGS.decode(self._tag_ids)
 
                 """A video library class."""
 
                 from .video import Video
+                from .video_playlist import _SortedKeys
+                from array import array
+                from bisect import bisect_left, insort
+                from collections import Counter, namedtuple
+                from concurrent.futures import ProcessPoolExecutor
+                from functools import partial
+                from itertools import (chain, compress, filterfalse, islice, repeat,
+                                       takewhile)
                 from pathlib import Path
+                import contextlib
                 import csv
+                import heapq
+                import mmap
+                import multiprocessing
+                import os
+                import random
+                import struct
+                import tempfile
+                import threading
+                import time
+                import tracemalloc
+                import zlib
 
                 # Helper Wrapper around CSV reader to strip whitespace from around
                 # each item.
                 def _csv_reader_with_strip(reader):
                     yield from ((item.strip() for item in line) for line in reader)
 
-                class VideoLibrary:
-                    """A class used to represent a Video Library."""
+                def _parse_video_lines(lines):
+                    """Yields (title, video_id, tags, weight) for every line of a videos.txt
+                    file. The weight is an optional fourth column, 1.0 when missing.
+                    """
+                    reader = _csv_reader_with_strip(csv.reader(lines, delimiter="|"))
+                    for video_info in reader:
+                        title, url, tags, *weight = video_info
+                        yield (
+                            title,
+                            url,
+                            [tag.strip() for tag in tags.split(",")] if tags else [],
+                            float(weight[0]) if weight and weight[0] else 1.0,
+                        )
+
+                def _parse_videos_file(path):
+                    """Yields (title, video_id, tags, weight) for every row of a videos.txt
+                    file.
+                    """
+                    with open(path) as video_file:
+                        yield from _parse_video_lines(video_file)
+
+                # Rows added per lock acquisition by the streaming loader.
+                _LOAD_CHUNK_ROWS = 10_000
+
+                # Number of videos added, updated and removed by VideoLibrary.reload.
+                CatalogDelta = namedtuple("CatalogDelta", ["added", "updated", "removed"])
+
+                # Compiled catalog layout, all integers in native byte order:
+                #   header       magic (8 bytes), row count N (uint64)
+                #   3 columns    N + 1 uint64 file offsets each (title, video_id, tags)
+                #   id order     N uint32 row numbers sorted by video_id
+                #   string heap  UTF-8 strings, tags joined with ","
+                _CATALOG_MAGIC = b"YTVCAT01"
+                _CATALOG_HEADER = struct.Struct("<8sQ")
+                _CATALOG_COLUMNS = 3
+
+                def compile_catalog(source_path, catalog_path):
+                    """Compiles a videos.txt file into the memory-mappable catalog format.
+                    Duplicate video_ids keep the first row's position and the last row's
+                    contents, the same as loading the text file directly.
+                    Args:
+                        source_path: The videos.txt file to read.
+                        catalog_path: The compiled catalog file to write.
+                    """
+                    rows = {}
+                    for title, video_id, tags, _ in _parse_videos_file(source_path):
+                        rows[video_id] = (title.encode(), video_id.encode(),
+                                          ",".join(tags).encode())
+                    rows = list(rows.values())
+                    count = len(rows)
+                    id_order = array("I", sorted(range(count), key=lambda row: rows[row][1]))
+                    position = (_CATALOG_HEADER.size + _CATALOG_COLUMNS * (count + 1) * 8
+                                + id_order.itemsize * count)
+                    columns = []
+                    for column in range(_CATALOG_COLUMNS):
+                        offsets = array("Q", [position])
+                        for row in rows:
+                            position += len(row[column])
+                            offsets.append(position)
+                        columns.append(offsets)
+                    with open(catalog_path, "wb") as catalog_file:
+                        catalog_file.write(_CATALOG_HEADER.pack(_CATALOG_MAGIC, count))
+                        for offsets in columns:
+                            catalog_file.write(offsets.tobytes())
+                        catalog_file.write(id_order.tobytes())
+                        for column in range(_CATALOG_COLUMNS):
+                            catalog_file.writelines(row[column] for row in rows)
+
+                class _MappedCatalog:
+                    """Read-only view of a compiled catalog file.
+                    Opening only maps the file; rows are decoded into Video objects when
+                    they are asked for, so only the touched pages become resident.
+                    """
+
+                    def __init__(self, catalog_path):
+                        with open(catalog_path, "rb") as catalog_file:
+                            self._map = mmap.mmap(
+                                catalog_file.fileno(), 0, access=mmap.ACCESS_READ)
+                        magic, self._count = _CATALOG_HEADER.unpack_from(self._map)
+                        if magic != _CATALOG_MAGIC:
+                            raise ValueError(f"{catalog_path} is not a compiled video catalog")
+                        view = memoryview(self._map)
+                        position = _CATALOG_HEADER.size
+                        self._columns = []
+                        for _ in range(_CATALOG_COLUMNS):
+                            end = position + (self._count + 1) * 8
+                            self._columns.append(view[position:end].cast("Q"))
+                            position = end
+                        self._id_order = view[position:position + self._count * 4].cast("I")
+
+                    def __len__(self):
+                        return self._count
+
+                    def __iter__(self):
+                        return (self._video(row) for row in range(self._count))
+
+                    def _field(self, column, row):
+                        offsets = self._columns[column]
+                        return self._map[offsets[row]:offsets[row + 1]]
+
+                    def _video(self, row):
+                        tags = self._field(2, row).decode()
+                        return Video(self._field(0, row).decode(),
+                                     self._field(1, row).decode(),
+                                     tags.split(",") if tags else [])
+
+                    def find(self, video_id):
+                        """Returns the Video for video_id, None if it is not in the catalog."""
+                        key = video_id.encode()
+                        low, high = 0, self._count
+                        while low < high:
+                            middle = (low + high) // 2
+                            if self._field(1, self._id_order[middle]) < key:
+                                low = middle + 1
+                            else:
+                                high = middle
+                        if low < self._count and self._field(1, self._id_order[low]) == key:
+                            return self._video(self._id_order[low])
+                        return None
+
+                # Length of the n-grams stored in the title index. Longer search terms
+                # intersect their n-grams, shorter ones are looked for in the index keys.
+                _NGRAM_SIZE = 3
+
+                def _ngrams(text, size):
+                    """Returns the set of all substrings of text of the given size."""
+                    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+                def _title_keys(title):
+                    """Returns the title index keys of a title: its case-folded trigrams,
+                    or the whole case-folded title if it is shorter than a trigram.
+                    """
+                    title = title.casefold()
+                    if len(title) < _NGRAM_SIZE:
+                        return {title} if title else set()
+                    return _ngrams(title, _NGRAM_SIZE)
+
+                def _fuzzy_plan(term, max_distance):
+                    """Returns how a fuzzy search of term uses the title index.
+                    A title within k edits of the term still shares all but at most 3 * k
+                    of the term's distinct trigrams, as every edit breaks at most 3 of
+                    them. If that bound requires no shared trigram, k is lowered until it
+                    does, since a filter requiring none would pass every title.
+                    Returns:
+                        A (distance, ngrams, required) tuple: the edits allowed, the
+                        trigrams to look up and how many of them a candidate must share.
+                        The distance is 0 when no trigram filter fits.
+                    """
+                    ngrams = _ngrams(term, _NGRAM_SIZE)
+                    for distance in range(max_distance, 0, -1):
+                        if len(ngrams) > _NGRAM_SIZE * distance:
+                            return distance, ngrams, len(ngrams) - _NGRAM_SIZE * distance
+                    return 0, set(), 0
+
+                def _substring_distance(term, text, bound):
+                    """Returns the fewest edits turning term into a substring of text, or
+                    bound + 1 if that takes more than bound edits.
+                    Uses Myers' bit-vector algorithm: each column of the edit distance
+                    table is kept as bit masks of its +1 and -1 steps, so every character
+                    of text costs a few integer operations instead of a loop over term.
+                    """
+                    if not term:
+                        return 0
+                    matches = {}
+                    for position, char in enumerate(term):
+                        matches[char] = matches.get(char, 0) | 1 << position
+                    mask = (1 << len(term)) - 1
+                    last = 1 << len(term) - 1
+                    positive, negative, distance = mask, 0, len(term)
+                    best = distance
+                    for char in text:
+                        equal = matches.get(char, 0)
+                        vertical = equal | negative
+                        horizontal = (((equal & positive) + positive) ^ positive) | equal
+                        up = negative | ~(horizontal | positive)
+                        down = positive & horizontal
+                        if up & last:
+                            distance += 1
+                        elif down & last:
+                            distance -= 1
+                            best = min(best, distance)
+                        # A match may start anywhere in text, so no step is shifted in.
+                        up = up << 1 & mask
+                        down = down << 1 & mask
+                        positive = down | ~(vertical | up) & mask
+                        negative = up & vertical
+                    return min(best, bound + 1)
+
+                def _format_video(video):
+                    """Returns the video as "title (video_id) [tags]"."""
+                    return f"{video.title} ({video.video_id}) [{' '.join(video.tags)}]"
+
+                def _describe_video(video, reason):
+                    """Returns the video as shown in listings, followed by its flag if
+                    reason is not None.
+                    """
+                    if reason is None:
+                        return _format_video(video)
+                    return f"{_format_video(video)} - FLAGGED (reason: {reason})"
+
+                def _completion_entries(video):
+                    """Returns the completion order entries of a video: its video_id and
+                    its title.
+                    """
+                    return [(text.casefold(), text, video.video_id)
+                            for text in (video.video_id, video.title)]
+
+                def _shard_ranges(path, shards):
+                    """Splits a file into at most shards byte ranges that start and end
+                    on line boundaries.
+                    Returns:
+                        A list of (start, end) offsets, in file order.
+                    """
+                    size = os.path.getsize(path)
+                    bounds = [0]
+                    with open(path, "rb") as video_file:
+                        for shard in range(1, shards):
+                            video_file.seek(max(size * shard // shards, bounds[-1]))
+                            # Finish the line the offset falls in.
+                            video_file.readline()
+                            bounds.append(min(video_file.tell(), size))
+                    bounds.append(size)
+                    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+                def _parse_shard(path, start, end):
+                    """Parses and indexes the rows of videos.txt between two byte offsets.
+                    Runs in the worker processes of VideoLibrary.ingest.
+                    Returns:
+                        The rows as (title, video_id, tags, weight), one per video_id in
+                        first-seen order with the last row's contents, and the title and
+                        tag postings of those rows as key -> array of row numbers.
+                    """
+                    with open(path, "rb") as video_file:
+                        video_file.seek(start)
+                        lines = video_file.read(end - start).decode().splitlines()
+                    rows = {}
+                    for row in _parse_video_lines(lines):
+                        rows[row[1]] = row
+                    title_postings = {}
+                    tag_postings = {}
+                    for number, (title, _, tags, _) in enumerate(rows.values()):
+                        for key in _title_keys(title):
+                            title_postings.setdefault(key, array("I")).append(number)
+                        for tag in {tag.casefold() for tag in tags}:
+                            tag_postings.setdefault(tag, array("I")).append(number)
+                    return list(rows.values()), title_postings, tag_postings
+
+                def _tokenize_tag_query(expression):
+                    """Splits a tag query into tags, operators and parentheses."""
+                    return expression.replace("(", " ( ").replace(")", " ) ").split()
+
+                def _contains_sorted(values, value):
+                    """Returns whether value is in the sorted sequence values."""
+                    position = bisect_left(values, value)
+                    return position < len(values) and values[position] == value
+
+                def _intersect_sorted(left, right):
+                    """Returns the sorted array of the ids in both sorted arrays.
+                    Every id of the shorter one is looked up in the longer one, so the
+                    cost follows the shorter one.
+                    """
+                    if len(left) > len(right):
+                        left, right = right, left
+                    return array("I", filter(partial(_contains_sorted, right), left))
+
+                def _subtract_sorted(left, right):
+                    """Returns the sorted array of the ids of left that are not in right."""
+                    return array("I", filterfalse(partial(_contains_sorted, right), left))
+
+                def _union_sorted(left, right):
+                    """Returns the sorted array of the ids in either sorted array."""
+                    return array("I", sorted(set(left).union(right)))
+
+                class _Complement(namedtuple("_Complement", ["ids"])):
+                    """Every dense id except the sorted ids, kept unexpanded so that
+                    "a AND NOT b" subtracts b from a without listing the library.
+                    """
+
+                class _TagQueryParser:
+                    """Evaluates a tag query, given a function returning the sorted dense
+                    ids posted under a tag.
+                    Results stay sorted arrays. NOT is kept as a _Complement until an
+                    OR or the end of the query needs its ids, and only then is all_ids
+                    called for the dense ids of every video.
+                    Grammar, loosest binding first:
+                        query  := term (OR term)*
+                        term   := factor (AND factor)*
+                        factor := NOT factor | "(" query ")" | tag
+                    """
+
+                    def __init__(self, expression, tag_postings, all_ids):
+                        self._tokens = _tokenize_tag_query(expression)
+                        self._position = 0
+                        self._tag_postings = tag_postings
+                        self._all_ids = all_ids
+
+                    def parse(self):
+                        if not self._tokens:
+                            raise ValueError("Empty tag query")
+                        result = self._query()
+                        if self._position != len(self._tokens):
+                            raise ValueError(
+                                f"Unexpected {self._tokens[self._position]!r} in tag query")
+                        return self._expand(result)
+
+                    def _expand(self, result):
+                        if isinstance(result, _Complement):
+                            return _subtract_sorted(self._all_ids(), result.ids)
+                        return result
+
+                    def _peek(self):
+                        if self._position < len(self._tokens):
+                            return self._tokens[self._position].upper()
+                        return None
+
+                    def _next(self):
+                        if self._position == len(self._tokens):
+                            raise ValueError("Incomplete tag query")
+                        token = self._tokens[self._position]
+                        self._position += 1
+                        return token
+
+                    def _query(self):
+                        result = self._term()
+                        while self._peek() == "OR":
+                            self._next()
+                            result = _union_sorted(self._expand(result),
+                                                   self._expand(self._term()))
+                        return result
+
+                    def _term(self):
+                        result = self._factor()
+                        while self._peek() == "AND":
+                            self._next()
+                            result = self._and(result, self._factor())
+                        return result
+
+                    @staticmethod
+                    def _and(left, right):
+                        if isinstance(left, _Complement) and isinstance(right, _Complement):
+                            return _Complement(_union_sorted(left.ids, right.ids))
+                        if isinstance(left, _Complement):
+                            left, right = right, left
+                        if isinstance(right, _Complement):
+                            return _subtract_sorted(left, right.ids)
+                        return _intersect_sorted(left, right)
+
+                    def _factor(self):
+                        token = self._next()
+                        if token.upper() == "NOT":
+                            operand = self._factor()
+                            if isinstance(operand, _Complement):
+                                return operand.ids
+                            return _Complement(operand)
+                        if token == "(":
+                            result = self._query()
+                            if self._next() != ")":
+                                raise ValueError("Missing ')' in tag query")
+                            return result
+                        if token.upper() in ("AND", "OR") or token == ")":
+                            raise ValueError(f"Unexpected {token!r} in tag query")
+                        return self._tag_postings(token.casefold())
+
+                _SYNTHETIC_WORDS = ("amazing", "funny", "cats", "dogs", "google", "life",
+                                    "music", "cooking", "travel", "review", "nothing")
+                _SYNTHETIC_TAGS = ("#cat", "#dog", "#animal", "#google", "#career",
+                                   "#music", "#food", "#travel")
+
+                def write_synthetic_videos_file(path, rows):
+                    """Writes a videos.txt file with generated rows for benchmarks.
+                    The same row count always produces the same file.
+                    Args:
+                        path: The file to write.
+                        rows: The number of videos to generate.
+                    """
+                    rng = random.Random(rows)
+                    with open(path, "w") as video_file:
+                        for row in range(rows):
+                            title = " ".join(rng.choices(_SYNTHETIC_WORDS, k=3))
+                            tags = " , ".join(rng.sample(_SYNTHETIC_TAGS, rng.randint(0, 3)))
+                            video_file.write(f"{title.capitalize()} {row} | video_{row}_id | {tags}\n")
+
+                def benchmark_video_memory(rows=1_000_000):
+                    """Prints the bytes per video of the original and the current Video.
+                    Both are built from the same synthetic videos.txt, counting every
+                    allocation the loaded videos keep alive (strings included).
+                    """
+
+                    class DictVideo:
+                        """The original Video layout: per-instance __dict__, fresh tags."""
+
+                        def __init__(self, video_title, video_id, video_tags):
+                            self._title = video_title
+                            self._video_id = video_id
+                            self._tags = tuple(video_tags)
+
+                    def bytes_per_video(video_class):
+                        tracemalloc.start()
+                        videos = [video_class(*row[:3]) for row in _parse_videos_file(path)]
+                        size = tracemalloc.get_traced_memory()[0]
+                        tracemalloc.stop()
+                        return size / len(videos)
+
+                    with tempfile.TemporaryDirectory() as directory:
+                        path = Path(directory) / "videos.txt"
+                        write_synthetic_videos_file(path, rows)
+                        before = bytes_per_video(DictVideo)
+                        after = bytes_per_video(Video)
+                    print(f"{rows} videos: {before:.1f} bytes/video before, "
+                          f"{after:.1f} bytes/video after "
+                          f"({100 * (before - after) / before:.1f}% smaller)")
+
+                def benchmark_read_scaling(rows=50_000, thread_counts=(1, 2, 4, 8),
+                                           seconds=1.0):
+                    """Prints the read throughput of one shared library by thread count.
+                    Every reader thread loops over get_video, search_titles and
+                    get_videos_with_tag while a writer thread keeps flagging and allowing
+                    videos.
+                    """
+                    with tempfile.TemporaryDirectory() as directory:
+                        path = Path(directory) / "videos.txt"
+                        write_synthetic_videos_file(path, rows)
+                        library = VideoLibrary()
+                        library.reload(path)
+
+                    def read(stopped, counts):
+                        rng = random.Random()
+                        reads = 0
+                        while not stopped.is_set():
+                            row = rng.randrange(rows // 10, rows)
+                            library.get_video(f"video_{row}_id")
+                            library.search_titles(str(row))
+                            library.get_videos_with_tag(rng.choice(_SYNTHETIC_TAGS))
+                            reads += 3
+                        counts.append(reads)
+
+                    def write(stopped):
+                        rng = random.Random(0)
+                        while not stopped.wait(0.1):
+                            video_id = f"video_{rng.randrange(rows)}_id"
+                            library.flag_video(video_id, "benchmark")
+                            library.allow_video(video_id)
+
+                    baseline = None
+                    for thread_count in thread_counts:
+                        stopped = threading.Event()
+                        counts = []
+                        threads = [threading.Thread(target=read, args=(stopped, counts))
+                                   for _ in range(thread_count)]
+                        threads.append(threading.Thread(target=write, args=(stopped,)))
+                        for thread in threads:
+                            thread.start()
+                        time.sleep(seconds)
+                        stopped.set()
+                        for thread in threads:
+                            thread.join()
+                        throughput = sum(counts) / seconds
+                        baseline = baseline or throughput
+                        print(f"{thread_count} reader threads: {throughput:,.0f} reads/s "
+                              f"({throughput / baseline:.2f}x)")
+
+                def benchmark_ingest(rows=200_000, worker_counts=None):
+                    """Prints the time to load a synthetic videos.txt row by row and with
+                    VideoLibrary.ingest for every worker count.
+                    """
+                    if worker_counts is None:
+                        worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+                    with tempfile.TemporaryDirectory() as directory:
+                        path = Path(directory) / "videos.txt"
+                        write_synthetic_videos_file(path, rows)
+                        library = VideoLibrary()
+                        start = time.perf_counter()
+                        library.reload(path)
+                        serial = time.perf_counter() - start
+                        print(f"{rows} rows, row by row: {serial:.2f}s")
+                        for workers in worker_counts:
+                            library = VideoLibrary()
+                            start = time.perf_counter()
+                            library.ingest(path, workers)
+                            elapsed = time.perf_counter() - start
+                            print(f"{rows} rows, {workers} workers: {elapsed:.2f}s "
+                                  f"({serial / elapsed:.2f}x)")
+
+                def _shard_of(video_id, shards):
+                    """Returns the shard owning video_id, the same in every process."""
+                    return zlib.crc32(video_id.encode()) % shards
+
+                # Sorted search results walk the title order instead of sorting the matches
+                # once the matches are at least 1/_TITLE_ORDER_SCAN_RATIO of the library.
+                _TITLE_ORDER_SCAN_RATIO = 8
+
+                def _check_weight(weight):
+                    if not weight > 0:
+                        raise ValueError(f"Video weights must be positive, got {weight!r}")
+
+                class _FenwickTree:
+                    """Prefix sums over a growing list of weights.
+                    Appending, changing a weight, the total and finding the position a
+                    prefix sum falls in all take O(log n).
+                    """
+
+                    def __init__(self):
+                        self._values = []
+                        # 1-based; node i holds the sum of values (i - lowbit(i), i].
+                        self._tree = [0.0]
+
+                    def __len__(self):
+                        return len(self._values)
+
+                    def append(self, value):
+                        index = len(self._tree)
+                        self._values.append(value)
+                        total = value
+                        child = index - 1
+                        stop = index - (index & -index)
+                        while child > stop:
+                            total += self._tree[child]
+                            child -= child & -child
+                        self._tree.append(total)
+
+                    def set(self, position, value):
+                        delta = value - self._values[position]
+                        self._values[position] = value
+                        index = position + 1
+                        while index < len(self._tree):
+                            self._tree[index] += delta
+                            index += index & -index
+
+                    def total(self):
+                        total = 0.0
+                        index = len(self._values)
+                        while index:
+                            total += self._tree[index]
+                            index -= index & -index
+                        return total
+
+                    def find(self, target):
+                        """Returns the first position whose prefix sum exceeds target."""
+                        position = 0
+                        step = 1 << (len(self._values).bit_length() - 1) if self._values else 0
+                        while step:
+                            index = position + step
+                            if index < len(self._tree) and self._tree[index] <= target:
+                                target -= self._tree[index]
+                                position = index
+                            step >>= 1
+                        return min(position, len(self._values) - 1)
+
+                class _LibraryState:
+                    """The catalog of a VideoLibrary at one point in time.
+                    Readers use a published state without locking: nothing it shows is
+                    changed again. Writers change a _Draft of it and publish the draft
+                    whole. The rows, the dense ids and the posting arrays are shared with
+                    the states published after it, which only append to them, so a state
+                    reads the dense ids below its count and ignores the rest.
+                    Flags and draw weights are not part of the state; see VideoLibrary.
+                    """
 
                     def __init__(self):
-                        """The VideoLibrary class is initialized."""
-                        self._videos = {}
-                        with open(Path(__file__).parent / "videos.txt") as video_file:
-                            reader = _csv_reader_with_strip(
-                                csv.reader(video_file, delimiter="|"))
-                            for video_info in reader:
-                                title, url, tags = video_info
-                                self._videos[url] = Video(
-                                    title,
-                                    url,
-                                    [tag.strip() for tag in tags.split(",")] if tags else [],
-                                )
+                        # The Video of every dense id, None once it is removed.
+                        self.rows = []
+                        # The number of dense ids, and of videos, in this state.
+                        self.count = 0
+                        self.size = 0
+                        # Every video's dense id. A removed video keeps its id, and gets
+                        # it back if it is added again.
+                        self.dense_ids = {}
+                        # Postings are sorted arrays of dense ids rather than sets of
+                        # video_ids: 4 bytes an entry, filtered against allowed by position.
+                        self.title_index = {}
+                        self.tag_index = {}
+                        # (title, video_id, dense id) in display order, built on first use.
+                        # A _SortedKeys, so a write copies its chunk list, not every entry.
+                        self.title_order = None
+                        # (case-folded text, text, video_id) of every video_id and title,
+                        # in a _SortedKeys for prefix completion, built on first use.
+                        self.completion_order = None
+                        self.version = 0
+
+                    def video(self, video_id):
+                        """Returns the Video with the given video_id, None if there is none."""
+                        dense_id = self.dense_ids.get(video_id)
+                        if dense_id is None or dense_id >= self.count:
+                            return None
+                        return self.rows[dense_id]
+
+                    def videos(self):
+                        """Returns an iterator over the videos, in library order."""
+                        return filter(None, islice(self.rows, self.count))
+
+                    def live_ids(self):
+                        """Returns the dense ids of the videos."""
+                        return [dense_id for dense_id, video in
+                                enumerate(islice(self.rows, self.count)) if video is not None]
+
+                    def visible(self, postings):
+                        """Returns the part of a posting array this state sees."""
+                        return postings[:bisect_left(postings, self.count)]
+
+                class _Draft:
+                    """A writable copy of a _LibraryState.
+                    New videos are appended past the base state's count, to the rows,
+                    dense ids and posting arrays it shares, so a write that only adds
+                    videos copies nothing it has published. Replacing or removing a video
+                    changes what the base state shows, so the rows, an index and each
+                    posting array are copied the first time such a change touches them.
+                    """
+
+                    video = _LibraryState.video
+                    videos = _LibraryState.videos
+
+                    def __init__(self, base):
+                        self._base = base
+                        vars(self).update((name, value) for name, value in vars(base).items()
+                                          if name != "count")
+                        self._owned = set()
+                        self._owned_postings = set()
+                        # Shared posting arrays changed past the base's count, by id.
+                        self._grown = {}
+                        self._appended = []
+                        # Flag slot changes to make once the draft is published, as dense
+                        # id -> (video_id, weight), with weight None for a removed video.
+                        self.slots = {}
+
+                    @property
+                    def count(self):
+                        return len(self.rows)
+
+                    def own(self, name):
+                        """Returns a container to change it, copied on first use."""
+                        value = getattr(self, name)
+                        if name not in self._owned:
+                            value = value.copy()
+                            setattr(self, name, value)
+                            self._owned.add(name)
+                        return value
+
+                    def append(self, video):
+                        """Adds a new video under the next dense id and returns the id."""
+                        dense_id = len(self.rows)
+                        self.rows.append(video)
+                        self.dense_ids[video.video_id] = dense_id
+                        self._appended.append(video.video_id)
+                        self.size += 1
+                        return dense_id
+
+                    def set_row(self, dense_id, video):
+                        """Replaces the video of a dense id, None to remove it."""
+                        rows = self.rows if dense_id >= self._base.count else self.own("rows")
+                        self.size += (video is not None) - (rows[dense_id] is not None)
+                        rows[dense_id] = video
+
+                    def add_posting(self, index, key, dense_id):
+                        postings = self._postings(index, key, dense_id)
+                        if postings and postings[-1] > dense_id:
+                            insort(postings, dense_id)
+                        else:
+                            postings.append(dense_id)
+
+                    def add_postings(self, index, key, dense_ids):
+                        """Adds new dense ids, ascending and above every posted one."""
+                        dense_ids = array("I", dense_ids)
+                        if dense_ids:
+                            self._postings(index, key, dense_ids[0]).extend(dense_ids)
+
+                    def remove_posting(self, index, key, dense_id):
+                        postings = self._postings(index, key, dense_id)
+                        del postings[bisect_left(postings, dense_id)]
+                        if not postings:
+                            del self.own(index)[key]
+                            self._owned_postings.discard((index, key))
+
+                    def _postings(self, index, key, dense_id):
+                        """Returns the posting array of key in the named index, to change
+                        the entry of dense_id; copied first if the base state shows it.
+                        """
+                        postings = getattr(self, index).get(key)
+                        if postings is None:
+                            postings = self.own(index)[key] = array("I")
+                            self._owned_postings.add((index, key))
+                        elif (index, key) not in self._owned_postings:
+                            if dense_id < self._base.count:
+                                postings = self.own(index)[key] = array("I", postings)
+                                self._owned_postings.add((index, key))
+                            else:
+                                self._grown[id(postings)] = postings
+                        return postings
+
+                    def publish(self):
+                        """Returns the draft as a new _LibraryState."""
+                        state = _LibraryState()
+                        for name in vars(state):
+                            setattr(state, name, getattr(self, name))
+                        return state
+
+                    def discard(self):
+                        """Takes back what the draft appended to the base state's shared
+                        containers.
+                        """
+                        base = self._base
+                        del base.rows[base.count:]
+                        for video_id in self._appended:
+                            base.dense_ids.pop(video_id, None)
+                        for postings in self._grown.values():
+                            del postings[bisect_left(postings, base.count):]
+
+                class VideoLibrary:
+                    """A class used to represent a Video Library.
+                    The catalog is kept in a _LibraryState that writes replace rather than
+                    change. Readers take the current state and never lock, so one library
+                    can be shared by any number of threads; writers serialize on a lock
+                    and publish their changes in a single assignment.
+                    Flags and draw weights are kept per dense id on the library itself and
+                    changed in place under the lock, so flagging a video costs O(log n)
+                    whatever the library size, and applies to every state at once.
+                    """
+
+                    _shared = None
+                    _shared_lock = threading.Lock()
+
+                    def __init__(self, catalog_path=None, streaming=False, workers=None,
+                                 path=None, shard=None):
+                        """The VideoLibrary class is initialized.
+                        Args:
+                            catalog_path: Optional file written by compile_catalog. When
+                                given it is memory-mapped instead of parsing videos.txt, and
+                                videos are only decoded once they are needed.
+                            streaming: Whether to parse videos.txt in a background thread.
+                                The library is usable right away and serves the videos
+                                loaded so far; see is_loaded and load_progress.
+                            workers: The number of processes parsing videos.txt in
+                                parallel, see ingest. None to parse it in this process.
+                            path: The videos.txt file to load, the one next to this module
+                                if None.
+                            shard: Optional (index, count) pair. Only the videos whose
+                                video_id hashes to shard index out of count are kept, on
+                                load and on reload; see ShardedVideoLibrary. Not used by
+                                ingest.
+                        """
+                        self._state = _LibraryState()
+                        self._draft = None
+                        # 1 for every dense id that may be shown, 0 once it is flagged or
+                        # removed, or before its video is published.
+                        self._allowed = bytearray()
+                        self._flag_reasons = {}
+                        self._flag_version = 0
+                        # The dense ids that may be played, and each one's index in
+                        # eligible, so that any of them is removed by swapping with the last.
+                        self._eligible = []
+                        self._eligible_positions = {}
+                        # Draw weight of every dense id, and their prefix sums with flagged
+                        # and removed videos counted as 0, for weighted_random_video.
+                        self._weights = []
+                        self._weight_sums = _FenwickTree()
+                        # SHOW_ALL_VIDEOS line of every dense id, as (video, line), built
+                        # the first time the video is listed.
+                        self._listing_lines = []
+                        self._catalog = None
+                        # Videos decoded from the catalog before it is materialized.
+                        self._decoded = {}
+                        self._lock = threading.RLock()
+                        self._loaded = threading.Event()
+                        self._load_error = None
+                        self._bytes_loaded = 0
+                        self._bytes_total = 0
+                        self._watching = None
+                        self._watch_error = None
+                        self._path = Path(path) if path is not None else (
+                            Path(__file__).parent / "videos.txt")
+                        self._shard = shard
+                        if catalog_path is not None:
+                            self._catalog = _MappedCatalog(catalog_path)
+                            self._loaded.set()
+                            return
+                        if streaming:
+                            threading.Thread(
+                                target=self._stream_load, args=(self._path,), daemon=True).start()
+                            return
+                        if workers is not None:
+                            self.ingest(self._path, workers)
+                        else:
+                            with self._writing():
+                                for title, url, tags, weight in self._owned(
+                                        _parse_videos_file(self._path)):
+                                    self.add_video(Video(title, url, tags), weight)
+                        self._loaded.set()
+
+                    def _owned(self, rows):
+                        """Returns the rows of the videos in this library's shard."""
+                        if self._shard is None:
+                            return rows
+                        index, count = self._shard
+                        return (row for row in rows if _shard_of(row[1], count) == index)
+
+                    @classmethod
+                    def shared(cls):
+                        """Returns the library shared by the whole process.
+                        It is loaded from videos.txt on the first call, so sessions
+                        running in threads can share one library instead of each parsing
+                        the file.
+                        """
+                        with cls._shared_lock:
+                            if cls._shared is None:
+                                cls._shared = cls()
+                            return cls._shared
+
+                    @contextlib.contextmanager
+                    def _writing(self):
+                        """Yields a draft of the state and publishes it at the end.
+                        Writes nest: a write made inside another one changes the same
+                        draft, which is published once, when the outermost write ends.
+                        Nothing is published if the write raises.
+                        """
+                        with self._lock:
+                            if self._draft is not None:
+                                yield self._draft
+                                return
+                            draft = self._draft = _Draft(self._state)
+                            try:
+                                yield draft
+                            except BaseException:
+                                draft.discard()
+                                raise
+                            else:
+                                # Slots of new videos exist, still 0, before they are shown.
+                                self._grow_slots(draft.count)
+                                self._state = draft.publish()
+                                self._update_slots(draft.slots)
+                            finally:
+                                self._draft = None
+
+                    def _stream_load(self, path):
+                        """Adds the rows of videos.txt in chunks of _LOAD_CHUNK_ROWS.
+                        Each chunk is published on its own, so readers are served while
+                        the rest of the file loads. A chunk only appends to the rows and
+                        postings earlier chunks published, so loading stays linear.
+                        """
+                        try:
+                            self._bytes_total = os.path.getsize(path)
+                            with open(path, "rb") as video_file:
+                                rows = self._owned(
+                                    _parse_video_lines(line.decode() for line in video_file))
+                                for chunk in iter(lambda: list(islice(rows, _LOAD_CHUNK_ROWS)), []):
+                                    with self._writing():
+                                        for title, url, tags, weight in chunk:
+                                            self.add_video(Video(title, url, tags), weight)
+                                    self._bytes_loaded = video_file.tell()
+                        except Exception as error:
+                            self._load_error = error
+                        finally:
+                            self._loaded.set()
+
+                    def ingest(self, path, workers=None):
+                        """Adds every row of a videos.txt file, parsed by worker processes.
+                        The file is split into byte ranges on line boundaries, which the
+                        workers parse and index in parallel. Their rows and postings are
+                        merged in file order without parsing anything again, so, as when
+                        loading row by row, a video_id seen again keeps its first position
+                        and takes the last row's contents. Everything is published at once.
+                        Args:
+                            path: The videos.txt file to read.
+                            workers: The number of worker processes, os.cpu_count() if None.
+                        Raises:
+                            ValueError: If a row has a weight that is not positive.
+                        """
+                        workers = workers or os.cpu_count() or 1
+                        # A few ranges per worker keep them busy while shards are merged.
+                        ranges = _shard_ranges(path, 4 * workers)
+                        self._materialize()
+                        with ProcessPoolExecutor(workers) as pool, self._writing() as state:
+                            # Rebuilt on first use rather than updated row by row. Dropped
+                            # first, so that a video_id seen again is not looked up in
+                            # orders that lack the rows merged before it.
+                            state.title_order = None
+                            state.completion_order = None
+                            starts, ends = zip(*ranges) if ranges else ((), ())
+                            for shard in pool.map(_parse_shard, repeat(path), starts, ends):
+                                self._merge_shard(state, *shard)
+
+                    def _merge_shard(self, state, rows, title_postings, tag_postings):
+                        """Adds the rows and postings returned by _parse_shard."""
+                        # The dense id of every row, and whether the row is a new video.
+                        dense_ids = array("I")
+                        fresh = bytearray()
+                        for title, video_id, tags, weight in rows:
+                            video = Video(title, video_id, tags)
+                            dense_id = state.dense_ids.get(video_id)
+                            if dense_id is not None:
+                                # The earlier row's postings are merged already; add_video
+                                # replaces them with this row's.
+                                self.add_video(video, weight)
+                                dense_ids.append(dense_id)
+                                fresh.append(0)
+                                continue
+                            _check_weight(weight)
+                            dense_id = state.append(video)
+                            state.slots[dense_id] = (video_id, weight)
+                            dense_ids.append(dense_id)
+                            fresh.append(1)
+                        for index, postings in (("title_index", title_postings),
+                                                ("tag_index", tag_postings)):
+                            for key, numbers in postings.items():
+                                state.add_postings(index, key, compress(
+                                    map(dense_ids.__getitem__, numbers),
+                                    map(fresh.__getitem__, numbers)))
+                        state.version += 1
+
+                    def is_loaded(self):
+                        """Returns whether every video has been loaded."""
+                        return self._loaded.is_set()
+
+                    def load_progress(self):
+                        """Returns the loaded fraction of videos.txt, from 0.0 to 1.0."""
+                        if self._loaded.is_set() or not self._bytes_total:
+                            return 1.0 if self._loaded.is_set() else 0.0
+                        return self._bytes_loaded / self._bytes_total
+
+                    def wait_until_loaded(self, timeout=None):
+                        """Blocks until every video has been loaded.
+                        Args:
+                            timeout: The maximum number of seconds to wait, None to wait
+                                for as long as it takes.
+                        Returns:
+                            True if loading finished, False if the timeout expired first.
+                        Raises:
+                            Exception: The error that stopped a streaming load, if any.
+                        """
+                        finished = self._loaded.wait(timeout)
+                        if self._load_error is not None:
+                            raise self._load_error
+                        return finished
+
+                    def reload(self, path=None):
+                        """Brings the library in line with the current videos.txt.
+                        Only the videos whose title, tags or weight changed are replaced,
+                        and only their index entries are touched. Unchanged videos keep their
+                        Video objects. The whole delta is published at once, so searches
+                        and listings see either the old or the new catalog.
+                        Args:
+                            path: The file to reload from, videos.txt by default.
+                        Returns:
+                            A CatalogDelta with the number of added, updated and removed
+                            videos.
+                        """
+                        rows = {url: (title, tuple(tags), weight) for title, url, tags, weight
+                                in self._owned(_parse_videos_file(path or self._path))}
+                        self.wait_until_loaded()
+                        self._materialize()
+                        with self._writing() as state:
+                            removed = [video.video_id for video in state.videos()
+                                       if video.video_id not in rows]
+                            for video_id in removed:
+                                self.remove_video(video_id)
+                            added = updated = 0
+                            for url, (title, tags, weight) in rows.items():
+                                video = state.video(url)
+                                if video is None:
+                                    added += 1
+                                elif (video.title != title or video.tags != tags
+                                      or self._weights[state.dense_ids[url]] != weight):
+                                    updated += 1
+                                else:
+                                    continue
+                                self.add_video(Video(title, url, tags), weight)
+                        return CatalogDelta(added, updated, len(removed))
+
+                    def watch(self, interval=1.0):
+                        """Reloads videos.txt in a background thread whenever it changes.
+                        Args:
+                            interval: Seconds between checks of the file's size and mtime.
+                        """
+                        if self._watching is not None:
+                            return
+                        self._watching = threading.Event()
+                        threading.Thread(target=self._watch, args=(self._watching, interval),
+                                         daemon=True).start()
+
+                    def stop_watching(self):
+                        """Stops the thread started by watch."""
+                        if self._watching is not None:
+                            self._watching.set()
+                            self._watching = None
+
+                    def watch_error(self):
+                        """Returns the error that stopped the last reload by watch, None if
+                        the last change of videos.txt was reloaded.
+                        The watcher skips a version of the file that fails to parse, and
+                        reloads again when the file next changes.
+                        """
+                        return self._watch_error
+
+                    def _watch(self, stopped, interval):
+                        def signature():
+                            stat = os.stat(self._path)
+                            return stat.st_mtime_ns, stat.st_size
+
+                        self.wait_until_loaded()
+                        last_seen = signature()
+                        while not stopped.wait(interval):
+                            try:
+                                current = signature()
+                                if current != last_seen:
+                                    self.reload()
+                                    last_seen = current
+                                    self._watch_error = None
+                            except OSError:
+                                # The file is missing or being replaced, try next time.
+                                continue
+                            except ValueError as error:
+                                # Parsing this version again would fail the same way.
+                                last_seen = current
+                                self._watch_error = error
+
+                    def _materialize(self):
+                        """Loads every row of a mapped catalog and builds the indexes.
+                        Called before any operation that needs the whole library.
+                        """
+                        if self._catalog is None:
+                            return
+                        with self._lock:
+                            if self._catalog is None:
+                                return
+                            with self._writing() as state:
+                                for video in self._catalog:
+                                    video = self._decoded.get(video.video_id, video)
+                                    dense_id = state.append(video)
+                                    self._index(state, video, dense_id, state.add_posting)
+                                    state.slots[dense_id] = (video.video_id, 1.0)
+                            # Published first, so that get_video never misses a catalog row.
+                            self._catalog = None
+                            self._decoded = {}
+
+                    def _index(self, state, video, dense_id, update_posting):
+                        """Applies update_posting to every index entry of the video."""
+                        for key in _title_keys(video.title):
+                            update_posting("title_index", key, dense_id)
+                        for tag in {tag.casefold() for tag in video.tags}:
+                            update_posting("tag_index", tag, dense_id)
+
+                    def add_video(self, video, weight=1.0):
+                        """Adds a video to the library and its indexes.
+                        A video with the same video_id is replaced, keeping its position.
+                        Args:
+                            video: The Video object to be added.
+                            weight: The video's weight in weighted_random_video.
+                        Raises:
+                            ValueError: If the weight is not positive.
+                        """
+                        _check_weight(weight)
+                        self._materialize()
+                        with self._writing() as state:
+                            dense_id = state.dense_ids.get(video.video_id)
+                            if dense_id is None:
+                                dense_id = state.append(video)
+                            else:
+                                previous = state.rows[dense_id]
+                                if previous is not None:
+                                    self._index(state, previous, dense_id, state.remove_posting)
+                                    self._unorder(state, previous, dense_id)
+                                state.set_row(dense_id, video)
+                            self._index(state, video, dense_id, state.add_posting)
+                            self._order(state, video, dense_id)
+                            state.slots[dense_id] = (video.video_id, weight)
+                            state.version += 1
+
+                    def remove_video(self, video_id):
+                        """Removes a video from the library and its indexes.
+                        Args:
+                            video_id: The video url.
+                        Returns:
+                            The removed Video object. None if the video does not exist.
+                        """
+                        self._materialize()
+                        with self._writing() as state:
+                            video = state.video(video_id)
+                            if video is not None:
+                                dense_id = state.dense_ids[video_id]
+                                self._index(state, video, dense_id, state.remove_posting)
+                                self._unorder(state, video, dense_id)
+                                state.set_row(dense_id, None)
+                                state.slots[dense_id] = (video_id, None)
+                                state.version += 1
+                        return video
+
+                    def _grow_slots(self, count):
+                        """Adds a 0 flag slot for every dense id up to count that has none."""
+                        for _ in range(len(self._allowed), count):
+                            self._allowed.append(0)
+                            self._weights.append(0.0)
+                            self._weight_sums.append(0.0)
+                            self._listing_lines.append(None)
+
+                    def _update_slots(self, slots):
+                        """Brings the flag slots of the videos a write changed in line."""
+                        for dense_id, (video_id, weight) in slots.items():
+                            if weight is None:
+                                self._allowed[dense_id] = 0
+                                self._weight_sums.set(dense_id, 0.0)
+                                self._flag_reasons.pop(video_id, None)
+                                self._make_ineligible(dense_id)
+                                self._listing_lines[dense_id] = None
+                                continue
+                            self._weights[dense_id] = weight
+                            if video_id in self._flag_reasons:
+                                continue
+                            if not self._allowed[dense_id]:
+                                self._allowed[dense_id] = 1
+                                self._make_eligible(dense_id)
+                            self._weight_sums.set(dense_id, weight)
+
+                    def _make_eligible(self, dense_id):
+                        """Appends the dense id to the ids random_video draws from."""
+                        self._eligible_positions[dense_id] = len(self._eligible)
+                        self._eligible.append(dense_id)
+
+                    def _make_ineligible(self, dense_id):
+                        """Removes the dense id from eligible by moving the last id into
+                        its place, if it is there.
+                        """
+                        position = self._eligible_positions.pop(dense_id, None)
+                        if position is None:
+                            return
+                        last = self._eligible.pop()
+                        if last != dense_id:
+                            self._eligible[position] = last
+                            self._eligible_positions[last] = position
+
+                    def flag_video(self, video_id, reason):
+                        """Flags a video so that it is left out of searches and playback.
+                        Args:
+                            video_id: The video url.
+                            reason: Why the video is flagged.
+                        Returns:
+                            False if the video does not exist, True otherwise.
+                        """
+                        self._materialize()
+                        with self._lock:
+                            state = self._state
+                            if state.video(video_id) is None:
+                                return False
+                            dense_id = state.dense_ids[video_id]
+                            self._allowed[dense_id] = 0
+                            self._weight_sums.set(dense_id, 0.0)
+                            self._make_ineligible(dense_id)
+                            self._flag_reasons[video_id] = reason
+                            self._relist(dense_id)
+                            self._flag_version += 1
+                        return True
+
+                    def allow_video(self, video_id):
+                        """Removes the flag from a video.
+                        Args:
+                            video_id: The video url.
+                        Returns:
+                            False if the video is not flagged, True otherwise.
+                        """
+                        self._materialize()
+                        with self._lock:
+                            if self._flag_reasons.pop(video_id, None) is None:
+                                return False
+                            dense_id = self._state.dense_ids[video_id]
+                            self._allowed[dense_id] = 1
+                            self._weight_sums.set(dense_id, self._weights[dense_id])
+                            self._make_eligible(dense_id)
+                            self._relist(dense_id)
+                            self._flag_version += 1
+                        return True
+
+                    def _relist(self, dense_id):
+                        """Builds the listing line of a video again after its flag changed,
+                        if it was built.
+                        """
+                        entry = self._listing_lines[dense_id]
+                        if entry is not None:
+                            self._listing_lines[dense_id] = None
+                            self._listing_line(entry[0], dense_id)
+
+                    def random_video(self, rng=random):
+                        """Returns a video drawn uniformly from the ones not flagged.
+                        The draw is a single index into a maintained array of the
+                        eligible dense ids, so it does not depend on the library size.
+                        Args:
+                            rng: The random.Random (or module) to draw with.
+                        Returns:
+                            A Video object. None if every video is flagged or the library
+                            is empty.
+                        """
+                        self._materialize()
+                        # Drawn under the lock, so that eligible is not emptied between
+                        # the check and the draw, and names no removed video.
+                        with self._lock:
+                            if not self._eligible:
+                                return None
+                            return self._state.rows[rng.choice(self._eligible)]
+
+                    def weighted_random_video(self, rng=random):
+                        """Returns a video not flagged, drawn with probability proportional
+                        to its weight. The draw descends a Fenwick tree of the weights, so
+                        it takes O(log n) and flag, allow and set_weight stay O(log n) too.
+                        Args:
+                            rng: The random.Random (or module) to draw with.
+                        Returns:
+                            A Video object. None if every video is flagged or the library
+                            is empty.
+                        """
+                        self._materialize()
+                        while self._eligible:
+                            dense_id = self._weight_sums.find(
+                                rng.random() * self._weight_sums.total())
+                            # Rounding in the sums can land on a zeroed slot; redraw.
+                            if self._allowed[dense_id]:
+                                video = self._state.rows[dense_id]
+                                if video is not None:
+                                    return video
+                        return None
+
+                    def get_weight(self, video_id):
+                        """Returns the video's draw weight, None if it does not exist."""
+                        self._materialize()
+                        state = self._state
+                        if state.video(video_id) is None:
+                            return None
+                        return self._weights[state.dense_ids[video_id]]
+
+                    def set_weight(self, video_id, weight):
+                        """Changes the video's weight in weighted_random_video.
+                        Returns:
+                            False if the video does not exist, True otherwise.
+                        Raises:
+                            ValueError: If the weight is not positive.
+                        """
+                        _check_weight(weight)
+                        self._materialize()
+                        with self._lock:
+                            state = self._state
+                            if state.video(video_id) is None:
+                                return False
+                            self._set_weight(state.dense_ids[video_id], weight)
+                        return True
+
+                    def set_tag_weight(self, video_tag, weight):
+                        """Sets the weight of every video currently carrying the video_tag.
+                        Returns:
+                            The number of videos changed.
+                        """
+                        _check_weight(weight)
+                        self._materialize()
+                        with self._lock:
+                            state = self._state
+                            dense_ids = state.visible(
+                                state.tag_index.get(video_tag.casefold(), ()))
+                            for dense_id in dense_ids:
+                                self._set_weight(dense_id, weight)
+                        return len(dense_ids)
+
+                    def _set_weight(self, dense_id, weight):
+                        self._weights[dense_id] = weight
+                        self._weight_sums.set(dense_id, weight * self._allowed[dense_id])
+
+                    def get_flag_reason(self, video_id):
+                        """Returns why the video is flagged, None if it is not flagged."""
+                        return self._flag_reasons.get(video_id)
+
+                    def get_flags(self):
+                        """Returns a dict of every flagged video_id and its reason."""
+                        return dict(self._flag_reasons)
+
+                    def _unflagged(self, dense_ids):
+                        """Returns the dense ids whose videos are not flagged.
+                        The dense ids are the candidates' slots in allowed, so compress
+                        filters them in C, without a per-id Python step.
+                        """
+                        if not self._flag_reasons:
+                            return dense_ids
+                        return compress(dense_ids, map(self._allowed.__getitem__, dense_ids))
+
+                    def _order(self, state, video, dense_id):
+                        """Adds the video to the title and completion orders that are built."""
+                        if state.title_order is not None:
+                            state.own("title_order").add((video.title, video.video_id, dense_id))
+                        if state.completion_order is not None:
+                            order = state.own("completion_order")
+                            for entry in _completion_entries(video):
+                                order.add(entry)
+
+                    def _unorder(self, state, video, dense_id):
+                        """Removes the video from the title and completion orders that are
+                        built.
+                        """
+                        if state.title_order is not None:
+                            state.own("title_order").remove(
+                                (video.title, video.video_id, dense_id))
+                        if state.completion_order is not None:
+                            order = state.own("completion_order")
+                            for entry in _completion_entries(video):
+                                order.remove(entry)
+
+                    @property
+                    def version(self):
+                        """A number that changes whenever a video is added, removed,
+                        flagged or allowed.
+                        """
+                        return self._state.version + self._flag_version
+
+                    def get_videos_by_title(self):
+                        """Returns all videos sorted by title, then by video_id.
+                        The order is sorted once and then kept up to date by add_video and
+                        remove_video, so no call after the first one sorts.
+                        """
+                        self._materialize()
+                        state = self._state
+                        return [state.rows[dense_id]
+                                for _, _, dense_id in self._title_order(state)]
+
+                    def get_listing_lines(self, flags=None):
+                        """Returns every video as shown by SHOW_ALL_VIDEOS, with its flag if
+                        any, sorted by title, then by video_id.
+                        Each line is kept by dense id once built, and only a flag, allow
+                        or change of its video builds it again, so listing the library
+                        again only collects the kept lines.
+                        Args:
+                            flags: Optional dict of video_id -> reason to show instead of
+                                the library's own flags, for a player keeping its own.
+                        """
+                        self._materialize()
+                        state = self._state
+                        rows = state.rows
+                        kept = self._listing_lines
+                        lines = [kept[dense_id][1]
+                                 if kept[dense_id] is not None and kept[dense_id][0] is rows[dense_id]
+                                 else self._listing_line(rows[dense_id], dense_id)
+                                 for _, _, dense_id in self._title_order(state)]
+                        if flags is None:
+                            return lines
+                        # Only the lines flagged by either side are built again.
+                        changed = set(flags).union(self.get_flags())
+                        if changed:
+                            for position, (_, video_id, dense_id) in enumerate(
+                                    self._title_order(state)):
+                                if video_id in changed:
+                                    lines[position] = _describe_video(
+                                        rows[dense_id], flags.get(video_id))
+                        return lines
+
+                    def _listing_line(self, video, dense_id):
+                        """Returns the video's listing line, building it if the one kept
+                        for its dense id is missing or was built for a replaced video.
+                        """
+                        entry = self._listing_lines[dense_id]
+                        if entry is None or entry[0] is not video:
+                            # Built under the lock, so that a flag changed meanwhile is not
+                            # overwritten by a line built with the old one.
+                            with self._lock:
+                                entry = (video, _describe_video(
+                                    video, self._flag_reasons.get(video.video_id)))
+                                self._listing_lines[dense_id] = entry
+                        return entry[1]
+
+                    def _title_order(self, state):
+                        """Returns the state's (title, video_id, dense id) in display order."""
+                        if state.title_order is None:
+                            # Readers racing here sort the same state to the same order.
+                            state.title_order = _SortedKeys(
+                                (video.title, video.video_id, dense_id) for dense_id, video
+                                in enumerate(islice(state.rows, state.count)) if video)
+                        return state.title_order
+
+                    def _in_title_order(self, state, dense_ids, contains, exclude_flagged):
+                        """Yields the videos of a collection of dense ids sorted by title,
+                        then by video_id, sorting only as far as the caller reads.
+                        contains tells whether a dense id is in the collection. Flagged
+                        videos are skipped as they are reached, so nothing is copied to
+                        leave them out.
+                        A collection holding a large part of the library is found along
+                        the maintained title order: at least one entry in
+                        _TITLE_ORDER_SCAN_RATIO matches, so the first k cost O(k) checks.
+                        A smaller one is heapified and popped one video at a time, so the
+                        first k cost O(n + k log n).
+                        """
+                        allowed = self._allowed if exclude_flagged else None
+                        rows = state.rows
+                        if len(dense_ids) * _TITLE_ORDER_SCAN_RATIO >= state.size:
+                            for _, _, dense_id in self._title_order(state):
+                                if contains(dense_id) and (allowed is None or allowed[dense_id]):
+                                    yield rows[dense_id]
+                            return
+                        heap = [(rows[dense_id].title, rows[dense_id].video_id, dense_id)
+                                for dense_id in dense_ids]
+                        heapq.heapify(heap)
+                        while heap:
+                            dense_id = heapq.heappop(heap)[2]
+                            if allowed is None or allowed[dense_id]:
+                                yield rows[dense_id]
+
+                    def complete(self, prefix, limit=None):
+                        """Returns the video_ids and titles starting with the prefix,
+                        ignoring case.
+                        They are kept in a chunked _SortedKeys, built on first use and
+                        then kept up to date by add_video and remove_video, so the first
+                        k completions cost a binary search and k steps, and a write only
+                        copies the chunks it changes.
+                        Args:
+                            prefix: The start of the video_id or title.
+                            limit: The maximum number of completions, None for all.
+                        Returns:
+                            A list of (text, video_id) pairs, where text is the video_id
+                            or the title, sorted by case-folded text, then text, then
+                            video_id.
+                        """
+                        self._materialize()
+                        state = self._state
+                        order = state.completion_order
+                        if order is None:
+                            # Readers racing here sort the same state to the same order.
+                            order = state.completion_order = _SortedKeys(chain.from_iterable(
+                                map(_completion_entries, state.videos())))
+                        prefix = prefix.casefold()
+                        entries = takewhile(lambda entry: entry[0].startswith(prefix),
+                                            order.from_key((prefix,)))
+                        return [(text, video_id) for _, text, video_id in islice(entries, limit)]
+
+                    def __len__(self):
+                        """Returns the number of videos, without loading a mapped catalog."""
+                        catalog = self._catalog
+                        if catalog is not None:
+                            return len(catalog)
+                        return self._state.size
+
+                    def __contains__(self, video_id):
+                        """Returns whether a video with the given video_id exists."""
+                        return self.get_video(video_id) is not None
+
+                    def __iter__(self):
+                        """Iterates over the videos without copying them.
+                        The iteration sees the library as it was when it started, even if
+                        it changes meanwhile.
+                        """
+                        self._materialize()
+                        return self._state.videos()
 
                     def get_all_videos(self):
                         """Returns all available video information from the video library."""
-                        return list(self._videos.values())
+                        self._materialize()
+                        return list(self._state.videos())
+
+                    def get_videos(self, offset=0, limit=None):
+                        """Returns one page of the videos, in library order.
+                        Args:
+                            offset: The number of videos to skip.
+                            limit: The maximum number of videos to return, None for all
+                                the remaining ones.
+                        Returns:
+                            A list of at most limit Video objects.
+                        """
+                        self._materialize()
+                        stop = None if limit is None else offset + limit
+                        return list(islice(self._state.videos(), offset, stop))
 
                     def get_video(self, video_id):
                         """Returns the video object (title, url, tags) from the video library.
@@ -252,65 +2100,1005 @@ class CommandParser:
                             The Video object for the requested video_id. None if the video
                             does not exist.
                         """
-                        return self._videos.get(video_id, None)
+                        # The catalog is read first: _materialize publishes the full state
+                        # before dropping the catalog, so one of the two has the video.
+                        catalog = self._catalog
+                        video = self._state.video(video_id)
+                        if video is None and catalog is not None:
+                            video = self._decoded.get(video_id)
+                            if video is None:
+                                video = catalog.find(video_id)
+                                if video is not None:
+                                    self._decoded[video_id] = video
+                        return video
+
+                    def search_titles(self, search_term, exclude_flagged=False):
+                        """Returns the videos whose titles contain the search_term.
+                        The match ignores case. Only the posting lists of the term's
+                        trigrams are visited, so the cost follows the number of
+                        candidates instead of the size of the library. A term shorter
+                        than a trigram is looked for in the index keys instead.
+                        Args:
+                            search_term: The query to be used in search.
+                            exclude_flagged: Whether to leave flagged videos out.
+                        Returns:
+                            A list of the matching Video objects, in no particular order.
+                        """
+                        self._materialize()
+                        state = self._state
+                        return [state.rows[dense_id] for dense_id in
+                                self._title_matches(state, search_term, exclude_flagged)]
+
+                    def iter_search_titles(self, search_term, exclude_flagged=False,
+                                           limit=None):
+                        """Yields the videos whose titles contain the search_term, sorted
+                        by title, then by video_id. Only the videos read are sorted.
+                        Args:
+                            search_term: The query to be used in search.
+                            exclude_flagged: Whether to leave flagged videos out.
+                            limit: The maximum number of videos to yield, None for all.
+                        """
+                        self._materialize()
+                        state = self._state
+                        dense_ids = self._title_matches(state, search_term, False)
+                        contains = (dense_ids.__contains__ if isinstance(dense_ids, set)
+                                    else partial(_contains_sorted, dense_ids))
+                        return islice(self._in_title_order(
+                            state, dense_ids, contains, exclude_flagged), limit)
+
+                    def _title_matches(self, state, search_term, exclude_flagged):
+                        """Returns the dense ids of the titles containing the search_term,
+                        as a set, or as a sorted array for a term of one trigram.
+                        """
+                        term = search_term.casefold()
+                        if not term:
+                            candidates = set(state.live_ids())
+                        elif len(term) < _NGRAM_SIZE:
+                            # Every key holding the term is a substring of the titles it
+                            # posts, so their union is exactly the matches.
+                            candidates = set().union(*(
+                                state.visible(postings)
+                                for key, postings in state.title_index.items() if term in key))
+                        else:
+                            postings = sorted(
+                                (state.visible(state.title_index.get(ngram, ()))
+                                 for ngram in _ngrams(term, _NGRAM_SIZE)),
+                                key=len)
+                            candidates = postings[0]
+                            if len(postings) > 1:
+                                candidates = set(candidates).intersection(*postings[1:])
+                        if exclude_flagged:
+                            candidates = self._unflagged(candidates)
+                        if len(term) > _NGRAM_SIZE:
+                            # N-grams may match out of order, so confirm the substring.
+                            return {dense_id for dense_id in candidates
+                                    if term in state.rows[dense_id].title.casefold()}
+                        return candidates
+
+                    def fuzzy_search_titles(self, search_term, max_distance=None,
+                                            exclude_flagged=False, limit=None):
+                        """Returns the videos whose titles contain the search_term with at
+                        most max_distance typos, ignoring case.
+                        A typo is a character inserted, deleted or replaced. Only titles
+                        sharing enough of the term's n-grams are compared with it, so the
+                        cost follows the number of candidates instead of the size of the
+                        library. A term too short for that filter matches exactly.
+                        Args:
+                            search_term: The query to be used in search.
+                            max_distance: The most typos allowed, a quarter of the length
+                                of the search_term if None.
+                            exclude_flagged: Whether to leave flagged videos out.
+                            limit: The maximum number of videos to return, None for all.
+                        Returns:
+                            A list of the matching Video objects, those with the fewest
+                            typos first, then sorted by title, then by video_id.
+                        Raises:
+                            ValueError: If max_distance is negative.
+                        """
+                        self._materialize()
+                        state = self._state
+                        return [state.rows[dense_id] for _, _, _, dense_id in islice(
+                            self._fuzzy_matches(state, search_term, max_distance,
+                                                exclude_flagged), limit)]
+
+                    def _fuzzy_matches(self, state, search_term, max_distance, exclude_flagged):
+                        """Returns the sorted (distance, title, video_id, dense id) of every
+                        video fuzzy_search_titles finds.
+                        """
+                        term = search_term.casefold()
+                        if max_distance is None:
+                            max_distance = len(term) // 4
+                        if max_distance < 0:
+                            raise ValueError("The fuzzy search distance cannot be negative")
+                        max_distance, ngrams, required = _fuzzy_plan(term, max_distance)
+                        if not max_distance:
+                            return sorted(
+                                (0, state.rows[dense_id].title, state.rows[dense_id].video_id,
+                                 dense_id) for dense_id in
+                                self._title_matches(state, search_term, exclude_flagged))
+                        shared = Counter(chain.from_iterable(
+                            state.visible(state.title_index.get(ngram, ())) for ngram in ngrams))
+                        candidates = [dense_id for dense_id, count in shared.items()
+                                      if count >= required]
+                        if exclude_flagged:
+                            candidates = self._unflagged(candidates)
+                        matches = []
+                        for dense_id in candidates:
+                            video = state.rows[dense_id]
+                            distance = _substring_distance(
+                                term, video.title.casefold(), max_distance)
+                            if distance <= max_distance:
+                                matches.append((distance, video.title, video.video_id, dense_id))
+                        matches.sort()
+                        return matches
+
+                    def get_videos_with_tag(self, video_tag, exclude_flagged=False):
+                        """Returns the videos carrying the video_tag, ignoring case.
+                        Args:
+                            video_tag: The video tag, including its leading "#".
+                            exclude_flagged: Whether to leave flagged videos out.
+                        Returns:
+                            A list of the matching Video objects, in no particular order.
+                        """
+                        self._materialize()
+                        state = self._state
+                        return [state.rows[dense_id] for dense_id in
+                                self._tag_matches(state, video_tag, exclude_flagged)]
+
+                    def iter_videos_with_tag(self, video_tag, exclude_flagged=False,
+                                             limit=None):
+                        """Yields the videos carrying the video_tag, ignoring case, sorted
+                        by title, then by video_id. Only the videos read are sorted.
+                        Args:
+                            video_tag: The video tag, including its leading "#".
+                            exclude_flagged: Whether to leave flagged videos out.
+                            limit: The maximum number of videos to yield, None for all.
+                        """
+                        self._materialize()
+                        state = self._state
+                        dense_ids = self._tag_matches(state, video_tag, False)
+                        return islice(self._in_title_order(
+                            state, dense_ids, partial(_contains_sorted, dense_ids),
+                            exclude_flagged), limit)
+
+                    def _tag_matches(self, state, video_tag, exclude_flagged):
+                        """Returns the dense ids of the videos carrying the video_tag."""
+                        dense_ids = state.visible(state.tag_index.get(video_tag.casefold(), ()))
+                        if exclude_flagged:
+                            dense_ids = self._unflagged(dense_ids)
+                        return dense_ids
+
+                    def query_tags(self, expression):
+                        """Returns the videos matching a boolean tag query.
+                        Tags are combined with AND, OR, NOT and parentheses, for example
+                        "#cat AND NOT (#dog OR #google)". Operators are case-insensitive
+                        and NOT binds tighter than AND, which binds tighter than OR.
+                        Args:
+                            expression: The tag query.
+                        Returns:
+                            A list of the matching Video objects, in no particular order.
+                        Raises:
+                            ValueError: If the expression is not a valid tag query.
+                        """
+                        self._materialize()
+                        state = self._state
+                        dense_ids = _TagQueryParser(
+                            expression,
+                            lambda tag: state.visible(state.tag_index.get(tag, ())),
+                            state.live_ids).parse()
+                        return [state.rows[dense_id] for dense_id in dense_ids]
+
+                def _listing_rows(library, flags):
+                    """Returns a shard's listing lines as (title, video_id, line) rows,
+                    which merge in title order.
+                    """
+                    library._materialize()
+                    state = library._state
+                    return [(title, video_id, line) for (title, video_id, _), line in zip(
+                        library._title_order(state), library.get_listing_lines(flags))]
+
+                def _video_row(video):
+                    """Returns a Video as a picklable (title, video_id, tags) tuple.
+                    Videos themselves hold tag ids of their own process's vocabulary.
+                    """
+                    return None if video is None else (video.title, video.video_id, video.tags)
+
+                def _row_video(row):
+                    return None if row is None else Video(*row)
+
+                def _eligible_totals(library):
+                    """Returns the number and total weight of the videos not flagged."""
+                    return len(library._eligible), library._weight_sums.total()
+
+                def _fuzzy_rows(library, search_term, max_distance, exclude_flagged, limit):
+                    """Returns a shard's fuzzy_search_titles as sorted (distance, row) pairs."""
+                    state = library._state
+                    return [(distance, _video_row(state.rows[dense_id]))
+                            for distance, _, _, dense_id in islice(library._fuzzy_matches(
+                                state, search_term, max_distance, exclude_flagged), limit)]
+
+                # What a shard worker runs for each request of ShardedVideoLibrary. Video
+                # lists come back as rows sorted by title, then video_id.
+                _SHARD_OPERATIONS = {
+                    "get_video": lambda library, video_id: _video_row(library.get_video(video_id)),
+                    "search_titles": lambda library, term, exclude_flagged, limit: list(
+                        map(_video_row, library.iter_search_titles(term, exclude_flagged, limit))),
+                    "get_videos_with_tag": lambda library, tag, exclude_flagged, limit: list(
+                        map(_video_row, library.iter_videos_with_tag(tag, exclude_flagged, limit))),
+                    "fuzzy_search_titles": _fuzzy_rows,
+                    "complete": VideoLibrary.complete,
+                    "get_videos_by_title": lambda library: list(
+                        map(_video_row, library.get_videos_by_title())),
+                    "get_listing_lines": _listing_rows,
+                    "len": len,
+                    "version": lambda library: library.version,
+                    "flag_video": VideoLibrary.flag_video,
+                    "allow_video": VideoLibrary.allow_video,
+                    "get_flag_reason": VideoLibrary.get_flag_reason,
+                    "get_flags": VideoLibrary.get_flags,
+                    "get_weight": VideoLibrary.get_weight,
+                    "eligible_totals": _eligible_totals,
+                    "random_video": lambda library: _video_row(library.random_video()),
+                    "weighted_random_video": lambda library: _video_row(
+                        library.weighted_random_video()),
+                }
+
+                def _shard_worker(connection, path, shard, shards):
+                    """Loads one shard and answers requests until it receives None.
+                    Every answer is a (result, error) pair.
+                    """
+                    try:
+                        library = VideoLibrary(path=path, shard=(shard, shards))
+                    except Exception as error:
+                        connection.send((None, error))
+                        return
+                    connection.send((None, None))
+                    while (request := connection.recv()) is not None:
+                        operation, arguments = request
+                        try:
+                            connection.send((_SHARD_OPERATIONS[operation](library, *arguments), None))
+                        except Exception as error:
+                            connection.send((None, error))
+
+                class ShardedVideoLibrary:
+                    """A video library partitioned by video_id hash across worker processes.
+                    Every worker holds a VideoLibrary of its own videos. Lookups by
+                    video_id go to the owning shard; searches and listings are sent to
+                    all shards at once, run in parallel, and their title-sorted results
+                    are k-way merged. It offers the part of the VideoLibrary interface
+                    VideoPlayer uses, with the same results, except that videos.txt is
+                    not reloaded.
+                    """
+
+                    def __init__(self, shards=None, path=None):
+                        """Starts the workers and waits until every shard is loaded.
+                        Args:
+                            shards: The number of worker processes, os.cpu_count() if None.
+                            path: The videos.txt file to load, the one next to this module
+                                if None.
+                        """
+                        shards = shards or os.cpu_count() or 1
+                        path = str(path or Path(__file__).parent / "videos.txt")
+                        self._lock = threading.RLock()
+                        self._connections = []
+                        self._processes = []
+                        for shard in range(shards):
+                            connection, child_connection = multiprocessing.Pipe()
+                            process = multiprocessing.Process(
+                                target=_shard_worker, daemon=True,
+                                args=(child_connection, path, shard, shards))
+                            process.start()
+                            child_connection.close()
+                            self._connections.append(connection)
+                            self._processes.append(process)
+                        try:
+                            for connection in self._connections:
+                                self._receive(connection)
+                        except Exception:
+                            self.close()
+                            raise
+
+                    def close(self):
+                        """Stops the worker processes."""
+                        with self._lock:
+                            for connection, process in zip(self._connections, self._processes):
+                                with contextlib.suppress(OSError):
+                                    connection.send(None)
+                                process.join()
+                                connection.close()
+                            self._connections = []
+                            self._processes = []
+
+                    @staticmethod
+                    def _receive(connection):
+                        result, error = connection.recv()
+                        if error is not None:
+                            raise error
+                        return result
+
+                    def _call(self, video_id, operation, *arguments):
+                        """Runs an operation on the shard owning video_id."""
+                        with self._lock:
+                            connection = self._connections[
+                                _shard_of(video_id, len(self._connections))]
+                            connection.send((operation, (video_id,) + arguments))
+                            return self._receive(connection)
+
+                    def _scatter(self, operation, *arguments):
+                        """Runs an operation on every shard, in parallel.
+                        Every shard's reply is read before an error is raised, so that no
+                        reply is left in a pipe to be taken for the answer to a later call.
+                        Returns:
+                            The shards' results, in shard order.
+                        Raises:
+                            Exception: The error of the first shard that failed.
+                        """
+                        with self._lock:
+                            for connection in self._connections:
+                                connection.send((operation, arguments))
+                            replies = [connection.recv() for connection in self._connections]
+                        for _, error in replies:
+                            if error is not None:
+                                raise error
+                        return [result for result, _ in replies]
+
+                    def _gather_videos(self, operation, *arguments):
+                        """Returns the Videos of a scattered listing, merged in title order."""
+                        return list(self._merge_videos(operation, *arguments))
+
+                    def _merge_videos(self, operation, *arguments):
+                        return map(_row_video, heapq.merge(*self._scatter(operation, *arguments)))
+
+                    def __len__(self):
+                        return sum(self._scatter("len"))
+
+                    def __contains__(self, video_id):
+                        return self.get_video(video_id) is not None
+
+                    @property
+                    def version(self):
+                        """A number that changes whenever any shard changes."""
+                        return sum(self._scatter("version"))
+
+                    def is_loaded(self):
+                        """Always True: the constructor waits for every shard."""
+                        return True
+
+                    def load_progress(self):
+                        return 1.0
+
+                    def wait_until_loaded(self, timeout=None):
+                        return True
+
+                    def get_video(self, video_id):
+                        """Returns the Video with the given video_id, None if it does not
+                        exist.
+                        """
+                        return _row_video(self._call(video_id, "get_video"))
+
+                    def get_videos_by_title(self):
+                        """Returns all videos sorted by title, then by video_id."""
+                        return self._gather_videos("get_videos_by_title")
+
+                    def get_all_videos(self):
+                        """Returns all videos, sorted by title, then by video_id."""
+                        return self.get_videos_by_title()
+
+                    def get_listing_lines(self, flags=None):
+                        """Returns every video as shown by SHOW_ALL_VIDEOS, with its flag if
+                        any, sorted by title, then by video_id.
+                        Args:
+                            flags: Optional dict of video_id -> reason to show instead of
+                                the library's own flags, for a player keeping its own.
+                        """
+                        return [line for _, _, line in heapq.merge(
+                            *self._scatter("get_listing_lines", flags))]
+
+                    def search_titles(self, search_term, exclude_flagged=False):
+                        """Returns the videos whose titles contain the search_term, ignoring
+                        case, sorted by title, then by video_id.
+                        """
+                        return self._gather_videos("search_titles", search_term,
+                                                   exclude_flagged, None)
+
+                    def iter_search_titles(self, search_term, exclude_flagged=False,
+                                           limit=None):
+                        """Yields the videos whose titles contain the search_term, sorted by
+                        title, then by video_id. With a limit, every shard sends only its
+                        first limit videos.
+                        """
+                        return islice(self._merge_videos("search_titles", search_term,
+                                                         exclude_flagged, limit), limit)
+
+                    def fuzzy_search_titles(self, search_term, max_distance=None,
+                                            exclude_flagged=False, limit=None):
+                        """Returns the videos whose titles contain the search_term with at
+                        most max_distance typos, fewest typos first, then sorted by title,
+                        then by video_id. With a limit, every shard sends only its first
+                        limit videos.
+                        """
+                        rows = heapq.merge(*self._scatter(
+                            "fuzzy_search_titles", search_term, max_distance,
+                            exclude_flagged, limit))
+                        return [_row_video(row) for _, row in islice(rows, limit)]
+
+                    def complete(self, prefix, limit=None):
+                        """Returns the video_ids and titles starting with the prefix,
+                        ignoring case, as (text, video_id) pairs in the order of
+                        VideoLibrary.complete. With a limit, every shard sends only its
+                        first limit completions.
+                        """
+                        completions = heapq.merge(
+                            *self._scatter("complete", prefix, limit),
+                            key=lambda completion: (completion[0].casefold(),) + completion)
+                        return list(islice(completions, limit))
+
+                    def get_videos_with_tag(self, video_tag, exclude_flagged=False):
+                        """Returns the videos carrying the video_tag, ignoring case, sorted
+                        by title, then by video_id.
+                        """
+                        return self._gather_videos("get_videos_with_tag", video_tag,
+                                                   exclude_flagged, None)
+
+                    def iter_videos_with_tag(self, video_tag, exclude_flagged=False,
+                                             limit=None):
+                        """Yields the videos carrying the video_tag, ignoring case, sorted by
+                        title, then by video_id. With a limit, every shard sends only its
+                        first limit videos.
+                        """
+                        return islice(self._merge_videos("get_videos_with_tag", video_tag,
+                                                         exclude_flagged, limit), limit)
+
+                    def flag_video(self, video_id, reason):
+                        return self._call(video_id, "flag_video", reason)
+
+                    def allow_video(self, video_id):
+                        return self._call(video_id, "allow_video")
+
+                    def get_flag_reason(self, video_id):
+                        return self._call(video_id, "get_flag_reason")
+
+                    def get_flags(self):
+                        flags = {}
+                        for shard_flags in self._scatter("get_flags"):
+                            flags.update(shard_flags)
+                        return flags
+
+                    def get_weight(self, video_id):
+                        return self._call(video_id, "get_weight")
+
+                    def random_video(self, rng=random):
+                        """Returns a video drawn uniformly from the ones not flagged.
+                        A shard is picked in proportion to its number of such videos, then
+                        draws one of them.
+                        """
+                        return self._draw(rng, 0, "random_video")
+
+                    def weighted_random_video(self, rng=random):
+                        """Returns a video not flagged, drawn with probability proportional
+                        to its weight. A shard is picked in proportion to its total weight,
+                        then draws by weight itself.
+                        """
+                        return self._draw(rng, 1, "weighted_random_video")
+
+                    def _draw(self, rng, total, operation):
+                        with self._lock:
+                            totals = [totals[total] for totals in self._scatter("eligible_totals")]
+                            if not any(totals):
+                                return None
+                            target = rng.random() * sum(totals)
+                            for shard, shard_total in enumerate(totals):
+                                if target < shard_total:
+                                    break
+                                target -= shard_total
+                            else:
+                                # Rounding left target past the end: take the last candidate.
+                                shard = max(shard for shard, shard_total in enumerate(totals)
+                                            if shard_total)
+                            connection = self._connections[shard]
+                            connection.send((operation, ()))
+                            return _row_video(self._receive(connection))
 
                     """A video player class."""
 
-                    from .video_library import VideoLibrary
+                    from itertools import islice
+                    import heapq
+                    import json
+                    import os
+                    import random
+                    import sys
+                    import threading
+                    from pathlib import Path
+                    from .video_library import VideoLibrary, _describe_video, _format_video
+                    from .video_playlist import PlaylistRegistry
+
+                    class StdoutSink:
+                        """Output sink writing to sys.stdout, the default of VideoPlayer.
+                        sys.stdout is looked up on every write, like print does.
+                        """
+
+                        def write(self, text):
+                            sys.stdout.write(text)
+
+                        def flush(self):
+                            sys.stdout.flush()
+
+                    class ListSink:
+                        """Output sink keeping the written lines in memory."""
+
+                        def __init__(self):
+                            self.lines = []
+
+                        def write(self, text):
+                            self.lines.extend(text.splitlines())
+
+                    class NullSink:
+                        """Output sink discarding everything, for benchmarks."""
+
+                        def write(self, text):
+                            pass
+
+                    def _fsync_directory(path):
+                        """Makes the entries renamed into a directory durable. Windows cannot
+                        open a directory, and commits renames without it.
+                        """
+                        if os.name == "nt":
+                            return
+                        directory = os.open(path, os.O_RDONLY)
+                        try:
+                            os.fsync(directory)
+                        finally:
+                            os.close(directory)
+
+                    class PlayerStore:
+                        """Durable storage for the playlists, flags and playback state of a player.
+                        Every change is appended to a write-ahead log as one JSON line holding a
+                        sequence number and the change. Appends are group-committed: a background
+                        thread writes and fsyncs everything queued since the previous commit every
+                        commit_interval seconds, so a burst of commands shares one fsync. Once
+                        snapshot_every changes have been logged, the player's whole state is written
+                        to a snapshot and the log starts over, so replaying on start-up costs the
+                        snapshot plus the changes made since.
+                        """
+
+                        def __init__(self, directory, commit_interval=0.05, snapshot_every=10_000):
+                            """PlayerStore constructor.
+                            Args:
+                                directory: The directory holding snapshot.json and changes.log.
+                                commit_interval: Seconds between group commits of the log.
+                                snapshot_every: The number of logged changes that triggers a snapshot.
+                            """
+                            self._directory = Path(directory)
+                            self._directory.mkdir(parents=True, exist_ok=True)
+                            self._snapshot_path = self._directory / "snapshot.json"
+                            self._log_path = self._directory / "changes.log"
+                            self._commit_interval = commit_interval
+                            self._snapshot_every = snapshot_every
+                            # _lock guards the pending records, _commit_lock orders the writes.
+                            self._lock = threading.Lock()
+                            self._commit_lock = threading.Lock()
+                            self._pending = []
+                            self._sequence = 0
+                            self._since_snapshot = 0
+                            self._log_file = None
+                            self._closed = threading.Event()
+
+                        def load(self):
+                            """Reads the state written by a previous run and opens the log.
+                            Returns:
+                                A (state, changes) tuple: the last snapshot's state, None if there is
+                                none, and the changes logged after it, oldest first.
+                            """
+                            state, snapshot_sequence = None, 0
+                            if self._snapshot_path.exists():
+                                with open(self._snapshot_path) as snapshot_file:
+                                    snapshot = json.load(snapshot_file)
+                                state, snapshot_sequence = snapshot["state"], snapshot["sequence"]
+                            self._sequence = snapshot_sequence
+                            changes = []
+                            valid_length = 0
+                            if self._log_path.exists():
+                                with open(self._log_path, "rb") as log_file:
+                                    for line in log_file:
+                                        try:
+                                            sequence, change = json.loads(line)
+                                        except ValueError:
+                                            # A torn write from a crash; nothing after it was committed.
+                                            break
+                                        valid_length += len(line)
+                                        # Changes up to the snapshot remain if a crash happened between
+                                        # writing the snapshot and emptying the log.
+                                        if sequence > snapshot_sequence:
+                                            changes.append(change)
+                                            self._sequence = sequence
+                            self._since_snapshot = len(changes)
+                            self._log_file = open(self._log_path, "ab")
+                            self._log_file.truncate(valid_length)
+                            threading.Thread(target=self._commit_periodically, daemon=True).start()
+                            return state, changes
+
+                        def append(self, change):
+                            """Queues a change for the next group commit.
+                            Args:
+                                change: A JSON-serializable list describing the change.
+                            """
+                            with self._lock:
+                                self._sequence += 1
+                                self._pending.append(json.dumps([self._sequence, change]) + "\n")
+                                self._since_snapshot += 1
+
+                        def needs_snapshot(self):
+                            """Returns whether enough changes were logged to compact the log."""
+                            return self._since_snapshot >= self._snapshot_every
+
+                        def commit(self):
+                            """Writes and fsyncs every queued change."""
+                            with self._commit_lock:
+                                with self._lock:
+                                    pending, self._pending = self._pending, []
+                                if pending:
+                                    self._log_file.write("".join(pending).encode())
+                                    self._log_file.flush()
+                                    os.fsync(self._log_file.fileno())
+
+                        def snapshot(self, state):
+                            """Replaces the snapshot with state and empties the log.
+                            Args:
+                                state: The JSON-serializable state including every queued change.
+                            """
+                            with self._commit_lock:
+                                with self._lock:
+                                    self._pending = []
+                                    sequence = self._sequence
+                                    self._since_snapshot = 0
+                                temporary_path = self._snapshot_path.with_suffix(".tmp")
+                                with open(temporary_path, "w") as snapshot_file:
+                                    json.dump({"sequence": sequence, "state": state}, snapshot_file)
+                                    snapshot_file.flush()
+                                    os.fsync(snapshot_file.fileno())
+                                os.replace(temporary_path, self._snapshot_path)
+                                # The rename is made durable before the log it replaces is
+                                # emptied, or a crash could leave the old snapshot and no log.
+                                _fsync_directory(self._directory)
+                                self._log_file.truncate(0)
+                                os.fsync(self._log_file.fileno())
+
+                        def close(self):
+                            """Commits the queued changes and closes the log."""
+                            self._closed.set()
+                            self.commit()
+                            self._log_file.close()
+
+                        def _commit_periodically(self):
+                            while not self._closed.wait(self._commit_interval):
+                                self.commit()
+
+                    # Number of completions COMPLETE shows when no limit is given.
+                    _COMPLETION_LIMIT = 10
+
+                    # Draws a random play makes before it lists the videos not flagged by the
+                    # player's own flags and picks among those instead.
+                    _SESSION_FLAG_REDRAWS = 16
 
                     class VideoPlayer:
                         """A class used to represent a Video Player."""
 
-                        def __init__(self):
-                            self._video_library = VideoLibrary()
+                        def __init__(self, video_library=None, output=None, store=None,
+                                     defer_answers=False, session_flags=False):
+                            """Creates a player.
+                            Args:
+                                video_library: The library to play from. If None, a new
+                                    VideoLibrary, or VideoLibrary.shared() with session_flags,
+                                    since such a player never changes its library.
+                                output: The sink receiving the player's output: any
+                                    object with a write(text) method, such as a buffered
+                                    text file, a ListSink or a NullSink. StdoutSink if None.
+                                store: Optional PlayerStore. The state it holds is restored
+                                    and every later change is saved to it. A library still
+                                    loading is waited for first, so that the restored flags
+                                    and current video find their videos.
+                                defer_answers: Whether a search leaves its "play any of the
+                                    above?" question pending for answer_search instead of
+                                    reading the answer with input(), for callers that cannot
+                                    block, such as the command server.
+                                session_flags: Whether the player keeps flags of its own
+                                    instead of flagging videos in the library, which it then
+                                    never changes, so that players sharing a library, such as
+                                    the command server's sessions, do not see each other's
+                                    flags. The library's own flags are not consulted.
+                            """
+                            if video_library is None:
+                                video_library = (VideoLibrary.shared() if session_flags
+                                                 else VideoLibrary())
+                            self._video_library = video_library
+                            self._output = output if output is not None else StdoutSink()
+                            self._current_video = None
+                            self._paused = False
+                            self._playlists = PlaylistRegistry()
+                            # Running PLAY_RANDOM SHUFFLE generators, by playlist key.
+                            self._shuffles = {}
+                            self._defer_answers = defer_answers
+                            # Results of the search waiting for answer_search.
+                            self._pending_results = None
+                            # Flags restored for videos the library does not have, kept so that
+                            # the next snapshot saves them again instead of dropping them.
+                            self._missing_flags = {}
+                            # The player's own flags, by video_id, if it keeps them.
+                            self._session_flags = {} if session_flags else None
+                            self._store = store
+                            if store is not None:
+                                state, changes = store.load()
+                                if state is not None or changes:
+                                    video_library.wait_until_loaded()
+                                if state is not None:
+                                    self._restore(state)
+                                for change in changes:
+                                    self._apply(change)
+
+                        def close(self):
+                            """Saves every pending change to the store, if there is one."""
+                            if self._store is not None:
+                                self._store.close()
+
+                        def _change(self, *change):
+                            """Applies a change to the player's state and saves it to the store."""
+                            self._apply(change)
+                            if self._store is not None:
+                                self._store.append(change)
+                                if self._store.needs_snapshot():
+                                    self._store.snapshot(self._state())
+
+                        def _apply(self, change):
+                            """Applies a change without any output. Used live and on replay."""
+                            operation, *arguments = change
+                            if operation == "play":
+                                self._current_video = self._video_library.get_video(arguments[0])
+                                self._paused = False
+                            elif operation == "stop":
+                                self._current_video = None
+                                self._paused = False
+                            elif operation == "pause":
+                                self._paused = True
+                            elif operation == "continue":
+                                self._paused = False
+                            elif operation == "create_playlist":
+                                self._playlists.create(arguments[0])
+                            elif operation == "delete_playlist":
+                                self._playlists.delete(arguments[0])
+                                self._shuffles.pop(arguments[0].casefold(), None)
+                            elif operation == "add_to_playlist":
+                                self._playlists.add_video(arguments[0], arguments[1])
+                            elif operation == "remove_from_playlist":
+                                self._playlists.remove_video(arguments[0], arguments[1])
+                            elif operation == "clear_playlist":
+                                self._playlists.clear(arguments[0])
+                            elif operation == "remove_everywhere":
+                                self._playlists.remove_video_everywhere(arguments[0])
+                            elif operation == "flag":
+                                if self._session_flags is not None:
+                                    self._session_flags[arguments[0]] = arguments[1]
+                                elif not self._video_library.flag_video(arguments[0], arguments[1]):
+                                    self._missing_flags[arguments[0]] = arguments[1]
+                            elif operation == "allow":
+                                if self._session_flags is not None:
+                                    self._session_flags.pop(arguments[0], None)
+                                elif not self._video_library.allow_video(arguments[0]):
+                                    self._missing_flags.pop(arguments[0], None)
+                            else:
+                                raise ValueError(f"Unknown player change {operation!r}")
+
+                        def _state(self):
+                            """Returns the player's state as JSON-serializable data."""
+                            flags = dict(self._missing_flags)
+                            flags.update(self._flags())
+                            return {
+                                "playlists": [[playlist.name, list(playlist)]
+                                              for playlist in self._playlists],
+                                "flags": flags,
+                                "current_video": (self._current_video.video_id
+                                                  if self._current_video is not None else None),
+                                "paused": self._paused,
+                            }
+
+                        def _restore(self, state):
+                            """Replaces the player's state with state returned by _state."""
+                            for name, video_ids in state["playlists"]:
+                                self._playlists.create(name)
+                                for video_id in video_ids:
+                                    self._playlists.add_video(name, video_id)
+                            for video_id, reason in state["flags"].items():
+                                self._apply(("flag", video_id, reason))
+                            if state["current_video"] is not None:
+                                self._current_video = self._video_library.get_video(state["current_video"])
+                                self._paused = state["paused"]
+
+                        def _flag_reason(self, video_id):
+                            """Returns why the video is flagged, None if it is not flagged."""
+                            if self._session_flags is not None:
+                                return self._session_flags.get(video_id)
+                            return self._video_library.get_flag_reason(video_id)
+
+                        def _flags(self):
+                            """Returns a dict of every flagged video_id and its reason."""
+                            if self._session_flags is not None:
+                                return dict(self._session_flags)
+                            return self._video_library.get_flags()
+
+                        def _describe(self, video, flags):
+                            """Returns the video as shown in listings, with its flag if any.
+                            Args:
+                                video: The Video to describe.
+                                flags: The player's _flags(), fetched once per listing so
+                                    that a sharded library is not asked once per video.
+                            """
+                            return _describe_video(video, flags.get(video.video_id))
+
+                        def _print(self, line):
+                            """Writes one line to the output sink."""
+                            self._output.write(line + "\n")
+
+                        def _print_lines(self, lines):
+                            """Writes all the lines to the output sink at once."""
+                            self._output.write("".join(line + "\n" for line in lines))
 
                         def number_of_videos(self):
-                            num_videos = len(self._video_library.get_all_videos())
-                            print(f"{num_videos} videos in the library")
+                            num_videos = len(self._video_library)
+                            if self._video_library.is_loaded():
+                                self._print(f"{num_videos} videos in the library")
+                            else:
+                                progress = self._video_library.load_progress()
+                                self._print(f"{num_videos} videos in the library "
+                                            f"(still loading, {progress:.0%} done)")
 
                         def show_all_videos(self):
                             """Returns all videos."""
 
-                            print("show_all_videos needs implementation")
+                            self._print_lines(["Here's a list of all available videos:"]
+                                              + self._video_library.get_listing_lines(
+                                                  self._session_flags))
 
                         def play_video(self, video_id):
                             """Plays the respective video.
                             Args:
                                 video_id: The video_id to be played.
                             """
-                            print("play_video needs implementation")
+                            video = self._video_library.get_video(video_id)
+                            if video is None:
+                                self._print("Cannot play video: Video does not exist")
+                                return
+                            reason = self._flag_reason(video_id)
+                            if reason is not None:
+                                self._print("Cannot play video: Video is currently flagged "
+                                            f"(reason: {reason})")
+                                return
+                            if self._current_video is not None:
+                                self.stop_video()
+                            self._print(f"Playing video: {video.title}")
+                            self._change("play", video_id)
 
                         def stop_video(self):
                             """Stops the current video."""
 
-                            print("stop_video needs implementation")
+                            if self._current_video is None:
+                                self._print("Cannot stop video: No video is currently playing")
+                                return
+                            self._print(f"Stopping video: {self._current_video.title}")
+                            self._change("stop")
 
-                        def play_random_video(self):
-                            """Plays a random video from the video library."""
-
-                            print("play_random_video needs implementation")
+                        def play_random_video(self, mode=None, playlist_name=None):
+                            """Plays a random video from the video library.
+                            Args:
+                                mode: None for a uniform draw, "WEIGHTED" to draw by video
+                                    weight, or "SHUFFLE" to play the next video of a shuffle of
+                                    the playlist that does not repeat until every video played.
+                                playlist_name: The playlist to shuffle, with the SHUFFLE mode.
+                            """
+                            mode = mode.upper() if mode is not None else None
+                            if mode is None and playlist_name is None:
+                                video = self._random_video(weighted=False)
+                            elif mode == "WEIGHTED" and playlist_name is None:
+                                video = self._random_video(weighted=True)
+                            elif mode == "SHUFFLE" and playlist_name is not None:
+                                playlist = self._playlists.get(playlist_name)
+                                if playlist is None:
+                                    self._print(f"Cannot shuffle playlist {playlist_name}: "
+                                                "Playlist does not exist")
+                                    return
+                                video = self._next_shuffled(playlist)
+                            else:
+                                self._print("Please enter PLAY_RANDOM command, optionally followed "
+                                            "by WEIGHTED or by SHUFFLE and a playlist name.")
+                                return
+                            if video is None:
+                                self._print("No videos available")
+                                return
+                            self.play_video(video.video_id)
+
+                        def _random_video(self, weighted):
+                            """Draws a video from the library, leaving out the ones flagged by
+                            the player's own flags.
+                            A draw landing on one of those is redrawn. Once a few redraws have
+                            landed on them, most videos must be flagged, and the draw is made
+                            among the listed others instead.
+                            Returns:
+                                A Video object. None if every video is flagged.
+                            """
+                            library = self._video_library
+                            draw = library.weighted_random_video if weighted else library.random_video
+                            flags = self._session_flags
+                            for _ in range(_SESSION_FLAG_REDRAWS):
+                                video = draw()
+                                if video is None or not flags or video.video_id not in flags:
+                                    return video
+                            videos = [video for video in library.get_videos_by_title()
+                                      if video.video_id not in flags]
+                            if not videos:
+                                return None
+                            if weighted:
+                                return random.choices(videos, [library.get_weight(video.video_id)
+                                                               for video in videos])[0]
+                            return random.choice(videos)
+
+                        def _next_shuffled(self, playlist):
+                            """Returns the next playable video of the playlist's shuffle.
+                            A new shuffle starts once the current one runs out.
+                            Returns:
+                                A Video object. None if no video of the playlist can be played.
+                            """
+                            for _ in range(2):
+                                shuffle = self._shuffles.get(playlist.key)
+                                if shuffle is None:
+                                    shuffle = self._shuffles[playlist.key] = playlist.shuffled()
+                                for video_id in shuffle:
+                                    video = self._video_library.get_video(video_id)
+                                    if (video is not None and
+                                            self._flag_reason(video_id) is None):
+                                        return video
+                                del self._shuffles[playlist.key]
+                            return None
 
                         def pause_video(self):
                             """Pauses the current video."""
 
-                            print("pause_video needs implementation")
+                            if self._current_video is None:
+                                self._print("Cannot pause video: No video is currently playing")
+                            elif self._paused:
+                                self._print(f"Video already paused: {self._current_video.title}")
+                            else:
+                                self._print(f"Pausing video: {self._current_video.title}")
+                                self._change("pause")
 
                         def continue_video(self):
                             """Resumes playing the current video."""
 
-                            print("continue_video needs implementation")
+                            if self._current_video is None:
+                                self._print("Cannot continue video: No video is currently playing")
+                            elif not self._paused:
+                                self._print("Cannot continue video: Video is not paused")
+                            else:
+                                self._print(f"Continuing video: {self._current_video.title}")
+                                self._change("continue")
 
                         def show_playing(self):
                             """Displays video currently playing."""
 
-                            print("show_playing needs implementation")
+                            if self._current_video is None:
+                                self._print("No video is currently playing")
+                                return
+                            paused = " - PAUSED" if self._paused else ""
+                            self._print(f"Currently playing: {_format_video(self._current_video)}{paused}")
 
                         def create_playlist(self, playlist_name):
                             """Creates a playlist with a given name.
                             Args:
                                 playlist_name: The playlist name.
                             """
-                            print("create_playlist needs implementation")
+                            if playlist_name in self._playlists:
+                                self._print("Cannot create playlist: A playlist with the same "
+                                            "name already exists")
+                                return
+                            self._change("create_playlist", playlist_name)
+                            self._print(f"Successfully created new playlist: {playlist_name}")
 
                         def add_to_playlist(self, playlist_name, video_id):
                             """Adds a video to a playlist with a given name.
@@ -318,19 +3106,58 @@ class CommandParser:
                                 playlist_name: The playlist name.
                                 video_id: The video_id to be added.
                             """
-                            print("add_to_playlist needs implementation")
+                            playlist = self._playlists.get(playlist_name)
+                            if playlist is None:
+                                self._print(f"Cannot add video to {playlist_name}: "
+                                            "Playlist does not exist")
+                                return
+                            video = self._video_library.get_video(video_id)
+                            if video is None:
+                                self._print(f"Cannot add video to {playlist_name}: "
+                                            "Video does not exist")
+                                return
+                            reason = self._flag_reason(video_id)
+                            if reason is not None:
+                                self._print(f"Cannot add video to {playlist_name}: "
+                                            "Video is currently flagged "
+                                            f"(reason: {reason})")
+                                return
+                            if video_id in playlist:
+                                self._print(f"Cannot add video to {playlist_name}: "
+                                            "Video already added")
+                                return
+                            self._change("add_to_playlist", playlist_name, video_id)
+                            self._print(f"Added video to {playlist_name}: {video.title}")
 
                         def show_all_playlists(self):
                             """Display all playlists."""
 
-                            print("show_all_playlists needs implementation")
+                            if not self._playlists:
+                                self._print("No playlists exist yet")
+                                return
+                            self._print_lines(["Showing all playlists:"]
+                                              + [f"  {playlist.name}" for playlist in self._playlists])
 
                         def show_playlist(self, playlist_name):
                             """Display all videos in a playlist with a given name.
                             Args:
                                 playlist_name: The playlist name.
                             """
-                            print("show_playlist needs implementation")
+                            playlist = self._playlists.get(playlist_name)
+                            if playlist is None:
+                                self._print(f"Cannot show playlist {playlist_name}: "
+                                            "Playlist does not exist")
+                                return
+                            lines = [f"Showing playlist: {playlist_name}"]
+                            flags = self._flags()
+                            for video_id in playlist:
+                                video = self._video_library.get_video(video_id)
+                                # Videos removed from the catalog by a reload are skipped.
+                                if video is not None:
+                                    lines.append(f"  {self._describe(video, flags)}")
+                            if len(lines) == 1:
+                                lines.append("  No videos here yet")
+                            self._print_lines(lines)
 
                         def remove_from_playlist(self, playlist_name, video_id):
                             """Removes a video to a playlist with a given name.
@@ -338,35 +3165,104 @@ class CommandParser:
                                 playlist_name: The playlist name.
                                 video_id: The video_id to be removed.
                             """
-                            print("remove_from_playlist needs implementation")
+                            playlist = self._playlists.get(playlist_name)
+                            if playlist is None:
+                                self._print(f"Cannot remove video from {playlist_name}: "
+                                            "Playlist does not exist")
+                                return
+                            video = self._video_library.get_video(video_id)
+                            if video is None:
+                                self._print(f"Cannot remove video from {playlist_name}: "
+                                            "Video does not exist")
+                                return
+                            if video_id not in playlist:
+                                self._print(f"Cannot remove video from {playlist_name}: "
+                                            "Video is not in playlist")
+                                return
+                            self._change("remove_from_playlist", playlist_name, video_id)
+                            self._print(f"Removed video from {playlist_name}: {video.title}")
 
                         def clear_playlist(self, playlist_name):
                             """Removes all videos from a playlist with a given name.
                             Args:
                                 playlist_name: The playlist name.
                             """
-                            print("clears_playlist needs implementation")
+                            playlist = self._playlists.get(playlist_name)
+                            if playlist is None:
+                                self._print(f"Cannot clear playlist {playlist_name}: "
+                                            "Playlist does not exist")
+                                return
+                            self._change("clear_playlist", playlist_name)
+                            self._print(f"Successfully removed all videos from {playlist_name}")
 
                         def delete_playlist(self, playlist_name):
                             """Deletes a playlist with a given name.
                             Args:
                                 playlist_name: The playlist name.
                             """
-                            print("deletes_playlist needs implementation")
+                            if playlist_name not in self._playlists:
+                                self._print(f"Cannot delete playlist {playlist_name}: "
+                                            "Playlist does not exist")
+                                return
+                            self._change("delete_playlist", playlist_name)
+                            self._print(f"Deleted playlist: {playlist_name}")
+
+                        def playlists_with_video(self, video_id):
+                            """Returns the names of the playlists containing the video, sorted."""
+                            return [playlist.name
+                                    for playlist in self._playlists.playlists_containing(video_id)]
+
+                        def forget_video(self, video_id):
+                            """Removes a video from every playlist, e.g. once it left the catalog.
+                            Args:
+                                video_id: The video_id to be removed.
+                            Returns:
+                                The names of the playlists the video was removed from.
+                            """
+                            names = self.playlists_with_video(video_id)
+                            if names:
+                                self._change("remove_everywhere", video_id)
+                            return names
 
-                        def search_videos(self, search_term):
+                        def search_videos(self, search_term, limit=None, offset=None):
                             """Display all the videos whose titles contain the search_term.
                             Args:
                                 search_term: The query to be used in search.
+                                limit: Optional number of results to show.
+                                offset: Optional number of results to skip, to show a later page.
                             """
-                            print("search_videos needs implementation")
+                            self._show_search_results(
+                                search_term,
+                                lambda stop: self._video_library.iter_search_titles(
+                                    search_term, exclude_flagged=True, limit=stop),
+                                limit, offset)
+
+                        def fuzzy_search_videos(self, search_term, limit=None, offset=None):
+                            """Display the videos whose titles contain the search_term, allowing
+                            for typos, those with the fewest typos first.
+                            Args:
+                                search_term: The query to be used in search.
+                                limit: Optional number of results to show.
+                                offset: Optional number of results to skip, to show a later page.
+                            """
+                            self._show_search_results(
+                                search_term,
+                                lambda stop: self._video_library.fuzzy_search_titles(
+                                    search_term, exclude_flagged=True, limit=stop),
+                                limit, offset)
 
-                        def search_videos_tag(self, video_tag):
+                        def search_videos_tag(self, video_tag, limit=None, offset=None):
                             """Display all videos whose tags contains the provided tag.
                             Args:
                                 video_tag: The video tag to be used in search.
+                                limit: Optional number of results to show.
+                                offset: Optional number of results to skip, to show a later page.
                             """
-                            print("search_videos_tag needs implementation")
+                            self._show_search_results(
+                                video_tag,
+                                lambda stop: self._video_library.iter_videos_with_tag(
+                                    video_tag, exclude_flagged=True, limit=stop),
+                                limit, offset)
 
                         def flag_video(self, video_id, flag_reason=""):
                             """Mark a video as flagged.
@@ -374,20 +3270,497 @@ class CommandParser:
                                 video_id: The video_id to be flagged.
                                 flag_reason: Reason for flagging the video.
                             """
-                            print("flag_video needs implementation")
+                            video = self._video_library.get_video(video_id)
+                            if video is None:
+                                self._print("Cannot flag video: Video does not exist")
+                                return
+                            if self._flag_reason(video_id) is not None:
+                                self._print("Cannot flag video: Video is already flagged")
+                                return
+                            if self._current_video is not None and self._current_video.video_id == video_id:
+                                self.stop_video()
+                            reason = flag_reason or "Not supplied"
+                            self._change("flag", video_id, reason)
+                            self._print(f"Successfully flagged video: {video.title} (reason: {reason})")
 
                         def allow_video(self, video_id):
                             """Removes a flag from a video.
                             Args:
                                 video_id: The video_id to be allowed again.
                             """
-                            print("allow_video needs implementation")
+                            video = self._video_library.get_video(video_id)
+                            if video is None:
+                                self._print("Cannot remove flag from video: Video does not exist")
+                                return
+                            if self._flag_reason(video_id) is None:
+                                self._print("Cannot remove flag from video: Video is not flagged")
+                                return
+                            self._change("allow", video_id)
+                            self._print(f"Successfully removed flag from video: {video.title}")
+
+                        def completions(self, prefix, limit=None):
+                            """Returns the video_ids, video titles and playlist names starting
+                            with the prefix, ignoring case.
+                            The library and the playlists each give their first limit
+                            completions from a sorted index, which are merged, so the cost
+                            follows limit rather than the number of videos and playlists.
+                            Args:
+                                prefix: The start of the text to complete.
+                                limit: The maximum number of completions, None for all.
+                            Returns:
+                                A list of (text, value) pairs sorted by case-folded text, where
+                                value is what a command takes for text: the video_id of a
+                                video_id or title, or the name of a playlist.
+                            """
+                            names = self._playlists.complete(prefix, limit)
+                            completions = heapq.merge(
+                                self._video_library.complete(prefix, limit), zip(names, names),
+                                key=lambda completion: (completion[0].casefold(),) + completion)
+                            return list(islice(completions, limit))
+
+                        def complete(self, prefix, limit=None):
+                            """Lists the video_ids, video titles and playlist names starting
+                            with the prefix, ignoring case.
+                            Args:
+                                prefix: The start of the text to complete.
+                                limit: Optional number of completions to show, 10 if None.
+                            """
+                            # isdecimal rather than isdigit, which accepts "²" that int() rejects.
+                            if limit is not None and not limit.isdecimal():
+                                self._print("Cannot complete: The number of completions must "
+                                            "be a number")
+                                return
+                            if limit is not None and int(limit) < 1:
+                                self._print("Cannot complete: The number of completions must "
+                                            "be at least 1")
+                                return
+                            completions = self.completions(
+                                prefix, _COMPLETION_LIMIT if limit is None else int(limit))
+                            if not completions:
+                                self._print(f"No completions for {prefix}")
+                                return
+                            self._print_lines(
+                                [f"Here are the completions for {prefix}:"]
+                                + [f"  {text}" if text == value else f"  {text} ({value})"
+                                   for text, value in completions])
+
+                        def _show_search_results(self, search_term, search, limit, offset):
+                            """Lists one page of search results and plays the one the user picks.
+                            Results are numbered from the first result, not from the page, and
+                            picking a number of an earlier page plays that result too.
+                            Args:
+                                search_term: The query the results were found for.
+                                search: Returns an iterator over the first stop matching
+                                    videos (all of them if stop is None), in display order.
+                                limit: The page size as typed, None for all the results.
+                                offset: The number of results to skip as typed, None for 0.
+                            """
+                            search = self._without_session_flags(search)
+                            # isdecimal rather than isdigit, which accepts "²" that int() rejects.
+                            if not all(value is None or value.isdecimal() for value in (limit, offset)):
+                                self._print("Cannot search videos: The page size and offset "
+                                            "must be numbers")
+                                return
+                            if limit is not None and int(limit) < 1:
+                                self._print("Cannot search videos: The page size must be at "
+                                            "least 1")
+                                return
+                            offset = int(offset or 0)
+                            stop = None if limit is None else offset + int(limit)
+                            videos = list(islice(search(stop), offset, None))
+                            if not videos:
+                                if offset:
+                                    self._print(f"No more search results for {search_term}")
+                                else:
+                                    self._print(f"No search results for {search_term}")
+                                return
+                            self._print_lines(
+                                [f"Here are the results for {search_term}:"]
+                                + [f"{number}) {_format_video(video)}"
+                                   for number, video in enumerate(videos, offset + 1)]
+                                + ["Would you like to play any of the above? If yes, "
+                                   "specify the number of the video.",
+                                   "If your answer is not a valid number, we will assume "
+                                   "it's a no."])
+                            results = (search, offset, videos)
+                            if self._defer_answers:
+                                self._pending_results = results
+                                return
+                            # The question has to be visible before waiting for the answer.
+                            flush = getattr(self._output, "flush", None)
+                            if flush is not None:
+                                flush()
+                            try:
+                                answer = input()
+                            except EOFError:
+                                # Input ended without an answer, which counts as a no.
+                                return
+                            self._play_result(results, answer)
+
+                        def _without_session_flags(self, search):
+                            """Wraps a search of the library so that it also leaves out the
+                            videos flagged by the player's own flags.
+                            At most one result per flag is left out, so asking the library for
+                            that many more results still fills the page.
+                            """
+                            flags = self._session_flags
+                            if flags is None:
+                                return search
+
+                            def unflagged(stop):
+                                videos = search(None if stop is None else stop + len(flags))
+                                return islice((video for video in videos
+                                               if video.video_id not in flags), stop)
+                            return unflagged
+
+                        def awaiting_answer(self):
+                            """Returns whether a deferred search question is pending."""
+                            return self._pending_results is not None
+
+                        def answer_search(self, answer):
+                            """Answers the pending question of the last search.
+                            Args:
+                                answer: The number of the video to play; anything else is a no.
+                            """
+                            results, self._pending_results = self._pending_results, None
+                            if results is not None:
+                                self._play_result(results, answer)
+
+                        def _play_result(self, results, answer):
+                            """Plays the search result picked by answer, if it is valid.
+                            Args:
+                                results: The (search, offset, videos) of the page shown.
+                                answer: The number the user typed.
+                            """
+                            search, offset, videos = results
+                            if not answer.isdecimal():
+                                return
+                            number = int(answer)
+                            if offset < number <= offset + len(videos):
+                                video = videos[number - offset - 1]
+                            elif 1 <= number <= offset:
+                                video = next(islice(search(number), number - 1, None), None)
+                            else:
+                                return
+                            if video is not None:
+                                self.play_video(video.video_id)
                             """A video playlist class."""
 
+                            from bisect import bisect_left, insort
+                            from itertools import chain, islice, takewhile
+                            import random
+
+                            class _SortedKeys:
+                                """A sorted collection of strings stored as a list of chunks.
+                                Insertion and removal bisect to one chunk and only shift
+                                that chunk, which keeps them fast with millions of keys.
+                                A copy shares the chunks with the original and copies each
+                                one the first time it changes it, so copying costs one step
+                                per chunk and changing the copy leaves the original as it was.
+                                Any other sortable keys, such as tuples, work as well.
+                                """
+
+                                _CHUNK_SIZE = 1000
+
+                                def __init__(self, keys=()):
+                                    keys = sorted(keys)
+                                    self._chunks = [keys[start:start + self._CHUNK_SIZE]
+                                                    for start in range(0, len(keys), self._CHUNK_SIZE)]
+                                    # Largest key of every chunk, to find a key's chunk.
+                                    self._maxes = [chunk[-1] for chunk in self._chunks]
+                                    self._length = len(keys)
+                                    # ids of the chunks shared with another copy.
+                                    self._shared = set()
+
+                                def __len__(self):
+                                    return self._length
+
+                                def __iter__(self):
+                                    return chain.from_iterable(self._chunks)
+
+                                def copy(self):
+                                    keys = _SortedKeys()
+                                    keys._chunks = self._chunks.copy()
+                                    keys._maxes = self._maxes.copy()
+                                    keys._length = self._length
+                                    keys._shared = set(map(id, self._chunks))
+                                    self._shared.update(keys._shared)
+                                    return keys
+
+                                def _chunk(self, position):
+                                    """Returns the chunk at position to change it, copied if shared."""
+                                    chunk = self._chunks[position]
+                                    if id(chunk) in self._shared:
+                                        self._shared.discard(id(chunk))
+                                        chunk = self._chunks[position] = chunk.copy()
+                                    return chunk
+
+                                def add(self, key):
+                                    self._length += 1
+                                    if not self._chunks:
+                                        self._chunks.append([key])
+                                        self._maxes.append(key)
+                                        return
+                                    position = min(bisect_left(self._maxes, key),
+                                                   len(self._maxes) - 1)
+                                    chunk = self._chunk(position)
+                                    insort(chunk, key)
+                                    self._maxes[position] = chunk[-1]
+                                    if len(chunk) > 2 * self._CHUNK_SIZE:
+                                        self._chunks[position:position + 1] = [
+                                            chunk[:self._CHUNK_SIZE], chunk[self._CHUNK_SIZE:]]
+                                        self._maxes.insert(position, chunk[self._CHUNK_SIZE - 1])
+
+                                def from_key(self, key):
+                                    """Yields the keys from the first one not below key, in order.
+                                    The first one is found by bisection, so reading k of them costs
+                                    O(log n + k).
+                                    """
+                                    position = bisect_left(self._maxes, key)
+                                    if position < len(self._chunks):
+                                        chunk = self._chunks[position]
+                                        yield from islice(chunk, bisect_left(chunk, key), None)
+                                        yield from chain.from_iterable(
+                                            islice(self._chunks, position + 1, None))
+
+                                def starting_with(self, prefix):
+                                    """Yields the keys starting with prefix, in order."""
+                                    return takewhile(lambda key: key.startswith(prefix),
+                                                     self.from_key(prefix))
+
+                                def remove(self, key):
+                                    self._length -= 1
+                                    position = bisect_left(self._maxes, key)
+                                    chunk = self._chunk(position)
+                                    del chunk[bisect_left(chunk, key)]
+                                    if chunk:
+                                        self._maxes[position] = chunk[-1]
+                                    else:
+                                        del self._chunks[position]
+                                        del self._maxes[position]
+
+                            class PlaylistRegistry:
+                                """A class used to hold the playlists of a VideoPlayer.
+                                Playlists are looked up by case-folded name in a dict, and a
+                                sorted index of the names is kept up to date on create and
+                                delete so that listing them never sorts. A reverse index from
+                                video_id to the playlists containing it answers "which playlists
+                                include this video" in time proportional to the answer, so the
+                                playlists' videos must be changed through the registry.
+                                """
+
+                                def __init__(self):
+                                    self._playlists = {}
+                                    self._sorted_keys = _SortedKeys()
+                                    # video_id -> keys of the playlists containing the video.
+                                    self._containing = {}
+
+                                def __len__(self):
+                                    return len(self._playlists)
+
+                                def __contains__(self, playlist_name):
+                                    return playlist_name.casefold() in self._playlists
+
+                                def __iter__(self):
+                                    """Iterates over the playlists sorted by case-folded name."""
+                                    return (self._playlists[key] for key in self._sorted_keys)
+
+                                def get(self, playlist_name):
+                                    """Returns the playlist with the given name, ignoring case.
+                                    None if there is no such playlist.
+                                    """
+                                    return self._playlists.get(playlist_name.casefold())
+
+                                def create(self, playlist_name):
+                                    """Creates an empty playlist.
+                                    Returns:
+                                        The new Playlist. None if a playlist with the same
+                                        name, ignoring case, already exists.
+                                    """
+                                    playlist = Playlist(playlist_name)
+                                    if playlist.key in self._playlists:
+                                        return None
+                                    self._playlists[playlist.key] = playlist
+                                    self._sorted_keys.add(playlist.key)
+                                    return playlist
+
+                                def delete(self, playlist_name):
+                                    """Deletes a playlist.
+                                    Returns:
+                                        The deleted Playlist. None if it does not exist.
+                                    """
+                                    playlist = self._playlists.pop(playlist_name.casefold(), None)
+                                    if playlist is not None:
+                                        self._sorted_keys.remove(playlist.key)
+                                        self._forget(playlist)
+                                    return playlist
+
+                                def add_video(self, playlist_name, video_id):
+                                    """Appends a video to an existing playlist.
+                                    Returns:
+                                        False if the video was already in the playlist.
+                                    """
+                                    playlist = self._playlists[playlist_name.casefold()]
+                                    if not playlist.add(video_id):
+                                        return False
+                                    self._containing.setdefault(video_id, set()).add(playlist.key)
+                                    return True
+
+                                def remove_video(self, playlist_name, video_id):
+                                    """Removes a video from an existing playlist.
+                                    Returns:
+                                        False if the video was not in the playlist.
+                                    """
+                                    playlist = self._playlists[playlist_name.casefold()]
+                                    if not playlist.remove(video_id):
+                                        return False
+                                    self._unlink(video_id, playlist.key)
+                                    return True
+
+                                def clear(self, playlist_name):
+                                    """Removes all videos from an existing playlist."""
+                                    playlist = self._playlists[playlist_name.casefold()]
+                                    self._forget(playlist)
+                                    playlist.clear()
+
+                                def complete(self, prefix, limit=None):
+                                    """Returns the names of the playlists starting with prefix, ignoring
+                                    case, sorted by case-folded name. At most limit if it is not None.
+                                    """
+                                    return [self._playlists[key].name for key in
+                                            islice(self._sorted_keys.starting_with(prefix.casefold()), limit)]
+
+                                def playlists_containing(self, video_id):
+                                    """Returns the playlists containing the video, sorted by name."""
+                                    return [self._playlists[key]
+                                            for key in sorted(self._containing.get(video_id, ()))]
+
+                                def remove_video_everywhere(self, video_id):
+                                    """Removes a video from every playlist containing it.
+                                    Returns:
+                                        The playlists the video was removed from, sorted by name.
+                                    """
+                                    playlists = self.playlists_containing(video_id)
+                                    for playlist in playlists:
+                                        playlist.remove(video_id)
+                                    self._containing.pop(video_id, None)
+                                    return playlists
+
+                                def _forget(self, playlist):
+                                    """Drops the reverse index entries of every video in the playlist."""
+                                    for video_id in playlist:
+                                        self._unlink(video_id, playlist.key)
+
+                                def _unlink(self, video_id, key):
+                                    keys = self._containing[video_id]
+                                    keys.discard(key)
+                                    if not keys:
+                                        del self._containing[video_id]
+
                             class Playlist:
                                 """A class used to represent a Playlist."""
+
+                                def __init__(self, name):
+                                    """Playlist constructor.
+                                    Args:
+                                        name: The playlist name, kept as given for display.
+                                    """
+                                    self._name = name
+                                    self._key = name.casefold()
+                                    # Insertion-ordered video_id set: dict keys keep the
+                                    # order videos were added in, with O(1) lookup,
+                                    # append and removal. Each value is the video's index
+                                    # in _slots, which gives shuffled() O(1) access by
+                                    # position; removed videos leave None behind until
+                                    # more than half of _slots is empty.
+                                    self._video_ids = {}
+                                    self._slots = []
+                                    # Changes whenever _slots is rebuilt.
+                                    self._generation = 0
+
+                                @property
+                                def name(self):
+                                    """Returns the playlist name as it was created."""
+                                    return self._name
+
+                                @property
+                                def key(self):
+                                    """Returns the case-folded name used to look the playlist up."""
+                                    return self._key
+
+                                def __len__(self):
+                                    return len(self._video_ids)
+
+                                def __contains__(self, video_id):
+                                    return video_id in self._video_ids
+
+                                def __iter__(self):
+                                    """Iterates over the video_ids in the order they were added."""
+                                    return iter(self._video_ids)
+
+                                def add(self, video_id):
+                                    """Appends a video to the playlist.
+                                    Returns:
+                                        False if the video was already in the playlist.
+                                    """
+                                    if video_id in self._video_ids:
+                                        return False
+                                    self._video_ids[video_id] = len(self._slots)
+                                    self._slots.append(video_id)
+                                    return True
+
+                                def remove(self, video_id):
+                                    """Removes a video from the playlist.
+                                    Returns:
+                                        False if the video was not in the playlist.
+                                    """
+                                    if video_id not in self._video_ids:
+                                        return False
+                                    self._slots[self._video_ids.pop(video_id)] = None
+                                    if len(self._slots) > 2 * len(self._video_ids):
+                                        self._slots = list(self._video_ids)
+                                        for slot, video_id in enumerate(self._slots):
+                                            self._video_ids[video_id] = slot
+                                        self._generation += 1
+                                    return True
+
+                                def clear(self):
+                                    """Removes all videos from the playlist."""
+                                    self._video_ids.clear()
+                                    self._slots = []
+                                    self._generation += 1
+
+                                def shuffled(self, rng=random):
+                                    """Yields the video_ids in a random order, each one once.
+                                    The permutation is a Fisher-Yates shuffle run one step per
+                                    video yielded, with the swapped positions kept in a dict, so
+                                    nothing is copied and memory grows with the number of videos
+                                    yielded rather than the playlist size. Videos removed
+                                    meanwhile are skipped and videos added meanwhile are left
+                                    for the next shuffle.
+                                    Args:
+                                        rng: The random.Random (or module) to shuffle with.
+                                    """
+                                    yielded = set()
+                                    while True:
+                                        generation = self._generation
+                                        count = len(self._slots)
+                                        swapped = {}
+                                        for position in range(count):
+                                            if self._generation != generation:
+                                                # The slots were rebuilt; shuffle the rest anew.
+                                                break
+                                            pick = rng.randrange(position, count)
+                                            slot = swapped.get(pick, pick)
+                                            swapped[pick] = swapped.get(position, position)
+                                            video_id = self._slots[slot]
+                                            if video_id is not None and video_id not in yielded:
+                                                yielded.add(video_id)
+                                                yield video_id
+                                        else:
+                                            return
                                 import re
-                                from src.video_player import VideoPlayer
+                                from src.video_player import ListSink, NullSink, VideoPlayer
 
                                 def test_number_of_videos(capfd):
                                     player = VideoPlayer()
@@ -604,7 +3977,24 @@ class CommandParser:
                                     lines = out.splitlines()
                                     assert len(lines) == 1
                                     assert "Cannot continue video: No video is currently playing" in lines[0]
+
+                                def test_output_sinks():
+                                    sink = ListSink()
+                                    player = VideoPlayer(output=sink)
+                                    player.number_of_videos()
+                                    player.show_all_videos()
+
+                                    assert sink.lines[0] == "5 videos in the library"
+                                    assert sink.lines[1] == "Here's a list of all available videos:"
+                                    assert len(sink.lines) == 7
+
+                                    player = VideoPlayer(output=NullSink())
+                                    player.show_all_videos()
+
+                                    import random
+
                                     from src.video_player import VideoPlayer
+                                    from src.video_playlist import Playlist, PlaylistRegistry
 
                                     def test_create_playlist(capfd):
                                         player = VideoPlayer()
@@ -830,6 +4220,116 @@ class CommandParser:
                                         assert len(lines) == 1
                                         assert "Cannot delete playlist my_cool_playlist: Playlist does not exist" in \
                                                lines[0]
+
+                                    def test_playlist_keeps_insertion_order():
+                                        playlist = Playlist("My_Playlist")
+                                        assert playlist.add("b") and playlist.add("a") and playlist.add("c")
+                                        assert not playlist.add("a")
+                                        assert playlist.remove("b")
+                                        assert not playlist.remove("b")
+                                        playlist.add("b")
+
+                                        assert playlist.name == "My_Playlist"
+                                        assert playlist.key == "my_playlist"
+                                        assert list(playlist) == ["a", "c", "b"]
+                                        assert "a" in playlist and len(playlist) == 3
+
+
+                                    def test_playlist_registry_lists_sorted_names():
+                                        registry = PlaylistRegistry()
+                                        names = [f"Playlist_{number:05d}" for number in range(4000)]
+                                        random.Random(0).shuffle(names)
+                                        for name in names:
+                                            assert registry.create(name) is not None
+                                        assert registry.create("PLAYLIST_00001") is None
+                                        for name in names[:1000]:
+                                            assert registry.delete(name.upper()) is not None
+
+                                        assert [playlist.name for playlist in registry] == sorted(names[1000:])
+                                        assert len(registry) == 3000
+                                        assert registry.get(names[-1].lower()).name == names[-1]
+
+
+                                    def test_playlists_with_video_follows_changes():
+                                        player = VideoPlayer()
+                                        for name in ("b_list", "A_list", "c_list"):
+                                            player.create_playlist(name)
+                                            player.add_to_playlist(name, "amazing_cats_video_id")
+                                        player.remove_from_playlist("c_list", "amazing_cats_video_id")
+                                        player.add_to_playlist("c_list", "funny_dogs_video_id")
+                                        assert player.playlists_with_video("amazing_cats_video_id") == ["A_list", "b_list"]
+
+                                        player.clear_playlist("b_list")
+                                        player.delete_playlist("c_list")
+                                        assert player.playlists_with_video("amazing_cats_video_id") == ["A_list"]
+                                        assert player.playlists_with_video("funny_dogs_video_id") == []
+
+                                        assert player.forget_video("amazing_cats_video_id") == ["A_list"]
+                                        assert player.playlists_with_video("amazing_cats_video_id") == []
+
+
+                                    def test_shuffled_yields_each_video_once():
+                                        playlist = Playlist("my_playlist")
+                                        for number in range(100):
+                                            playlist.add(f"video_{number}")
+                                        shuffle = playlist.shuffled(random.Random(0))
+                                        first = [next(shuffle) for _ in range(10)]
+                                        for number in range(0, 100, 3):
+                                            playlist.remove(f"video_{number}")
+                                        rest = list(shuffle)
+
+                                        assert len(first + rest) == len(set(first + rest))
+                                        assert set(rest) == set(playlist) - set(first)
+
+                                    def test_play_random_shuffle(capfd):
+                                        player = VideoPlayer()
+                                        player.create_playlist("my_playlist")
+                                        player.add_to_playlist("my_playlist", "amazing_cats_video_id")
+                                        player.add_to_playlist("my_playlist", "life_at_google_video_id")
+                                        player.play_random_video("SHUFFLE", "my_playlist")
+                                        player.play_random_video("shuffle", "my_playlist")
+                                        player.play_random_video("SHUFFLE", "another_playlist")
+                                        out, err = capfd.readouterr()
+                                        lines = out.splitlines()
+                                        assert {lines[3], lines[5]} == {"Playing video: Amazing Cats",
+                                                                        "Playing video: Life at Google"}
+                                        assert lines[6] == "Cannot shuffle playlist another_playlist: Playlist does not exist"
+
+
+                                    def test_complete_follows_playlists(capfd):
+                                        player = VideoPlayer()
+                                        player.create_playlist("Another_Playlist")
+                                        player.complete("ANOTHER")
+                                        player.delete_playlist("another_playlist")
+                                        player.complete("another", "1")
+                                        player.complete("zzz")
+                                        out, err = capfd.readouterr()
+                                        lines = out.splitlines()
+                                        assert len(lines) == 9
+                                        assert "Here are the completions for ANOTHER:" in lines[1]
+                                        assert "  Another Cat Video (another_cat_video_id)" in lines[2]
+                                        assert "  another_cat_video_id" in lines[3]
+                                        assert "  Another_Playlist" in lines[4]
+                                        assert "  Another Cat Video (another_cat_video_id)" in lines[7]
+                                        assert "No completions for zzz" in lines[8]
+
+
+                                    def test_complete_bad_limits(capfd):
+                                        player = VideoPlayer()
+                                        player.complete("another", "²")
+                                        player.complete("another", "0")
+                                        player.complete("another", "1")
+                                        out, err = capfd.readouterr()
+                                        lines = out.splitlines()
+                                        assert len(lines) == 4
+                                        assert "Cannot complete: The number of completions must be a number" in lines[0]
+                                        assert "Cannot complete: The number of completions must be at least 1" in lines[1]
+                                        assert "Here are the completions for another:" in lines[2]
+                                        assert "  Another Cat Video (another_cat_video_id)" in lines[3]
+
+                                        import io
+
+                                        from src.__main__ import run_batch
                                         from src.video_player import VideoPlayer
                                         from unittest import mock
 
@@ -970,9 +4470,119 @@ class CommandParser:
                                             lines = out.splitlines()
                                             assert len(lines) == 1
                                             assert "No search results for #blah" in lines[0]
+
+                                        def test_search_videos_deferred_answer(capfd):
+                                            player = VideoPlayer(defer_answers=True)
+                                            player.search_videos("cat")
+                                            assert player.awaiting_answer()
+                                            player.answer_search("2")
+                                            assert not player.awaiting_answer()
+                                            out, err = capfd.readouterr()
+                                            lines = out.splitlines()
+                                            assert len(lines) == 6
+                                            assert "Playing video: Another Cat Video" in lines[5]
+
+
+                                        @mock.patch('builtins.input', lambda *args: '1')
+                                        def test_search_videos_tag_page(capfd):
+                                            player = VideoPlayer()
+                                            player.search_videos_tag("#animal", "1", "1")
+                                            player.search_videos("cat", "2", "5")
+                                            out, err = capfd.readouterr()
+                                            lines = out.splitlines()
+                                            assert len(lines) == 6
+                                            assert "Here are the results for #animal:" in lines[0]
+                                            assert "2) Another Cat Video (another_cat_video_id) [#cat #animal]" in lines[1]
+                                            assert "Playing video: Amazing Cats" in lines[4]
+                                            assert "No more search results for cat" in lines[5]
+
+
+                                        @mock.patch('builtins.input', lambda *args: '²')
+                                        def test_search_videos_bad_numbers(capfd):
+                                            player = VideoPlayer()
+                                            player.search_videos("cat", "²")
+                                            player.search_videos("cat", "1", "²")
+                                            player.search_videos("cat", "0")
+                                            player.search_videos("cat", "1")
+                                            out, err = capfd.readouterr()
+                                            lines = out.splitlines()
+                                            assert len(lines) == 7
+                                            assert "Cannot search videos: The page size and offset must be numbers" in lines[0]
+                                            assert "Cannot search videos: The page size and offset must be numbers" in lines[1]
+                                            assert "Cannot search videos: The page size must be at least 1" in lines[2]
+                                            assert "Here are the results for cat:" in lines[3]
+                                            assert "1) Amazing Cats (amazing_cats_video_id) [#cat #animal]" in lines[4]
+
+
+                                        @mock.patch('builtins.input', lambda *args: '1')
+                                        def test_fuzzy_search_videos(capfd):
+                                            player = VideoPlayer()
+                                            player.fuzzy_search_videos("amazng")
+                                            player.fuzzy_search_videos("dgos")
+                                            out, err = capfd.readouterr()
+                                            lines = out.splitlines()
+                                            assert len(lines) == 6
+                                            assert "Here are the results for amazng:" in lines[0]
+                                            assert "1) Amazing Cats (amazing_cats_video_id) [#cat #animal]" in lines[1]
+                                            assert "Playing video: Amazing Cats" in lines[4]
+                                            assert "No search results for dgos" in lines[5]
+
+
+                                        def test_run_batch_answers_and_ends_on_a_search(capfd):
+                                            for player in (VideoPlayer(), VideoPlayer(defer_answers=True)):
+                                                run_batch(io.StringIO("SEARCH_VIDEOS cat\n1\nSEARCH_VIDEOS_WITH_TAG #dog\n"), player)
+                                                out, err = capfd.readouterr()
+                                                lines = out.splitlines()
+                                                assert len(lines) == 10
+                                                assert "Playing video: Amazing Cats" in lines[5]
+                                                assert "1) Funny Dogs (funny_dogs_video_id) [#dog #animal]" in lines[7]
+                                                assert "Executed 2 commands" in err
+
+
+                                        def test_server_sessions_keep_their_own_flags():
+                                            import asyncio
+
+                                            from src.__main__ import _start_server
+                                            from src.video_library import VideoLibrary
+
+                                            library = VideoLibrary()
+
+                                            async def connect(port):
+                                                reader, writer = await asyncio.open_connection("localhost", port)
+                                                await reader.readuntil(b"YT> ")
+
+                                                async def send(command):
+                                                    writer.write(command.encode() + b"\n")
+                                                    return (await reader.readuntil(b"YT> ")).decode()
+                                                return send, writer
+
+                                            async def run():
+                                                server = await _start_server("localhost:0", library)
+                                                async with server:
+                                                    port = server.sockets[0].getsockname()[1]
+                                                    first, first_writer = await connect(port)
+                                                    second, second_writer = await connect(port)
+                                                    assert "Successfully flagged video: Amazing Cats" in await first(
+                                                        "FLAG_VIDEO amazing_cats_video_id dont_like_cats")
+                                                    assert "- FLAGGED (reason: dont_like_cats)" in await first("SHOW_ALL_VIDEOS")
+                                                    assert "FLAGGED" not in await second("SHOW_ALL_VIDEOS")
+                                                    assert "Video is currently flagged" in await first("PLAY amazing_cats_video_id")
+                                                    assert "Playing video: Amazing Cats" in await second("PLAY amazing_cats_video_id")
+                                                    results = await first("SEARCH_VIDEOS cat 1")
+                                                    assert "1) Another Cat Video" in results and "Amazing Cats" not in results
+                                                    await first("No")
+                                                    assert "1) Amazing Cats" in await second("SEARCH_VIDEOS cat 1")
+                                                    await second("No")
+                                                    for writer in (first_writer, second_writer):
+                                                        writer.close()
+
+                                            asyncio.run(run())
+                                            assert library.get_flags() == {}
+
                                             from unittest import mock
 
-                                            from src.video_player import VideoPlayer
+                                            from src.video_player import PlayerStore, VideoPlayer
+                                            from src.video_library import VideoLibrary, write_synthetic_videos_file
 
                                             def test_flag_video_with_reason(capfd):
                                                 player = VideoPlayer()
@@ -1224,7 +4834,126 @@ class CommandParser:
                                                 assert "Successfully removed flag from video: Amazing Cats" in lines[5]
                                                 assert "Showing playlist: my_playlist" in lines[6]
                                                 assert "Amazing Cats (amazing_cats_video_id) [#cat #animal]" in lines[7]
-                                                from src.video_library import VideoLibrary
+
+                                            def test_player_state_survives_restart(capfd, tmp_path):
+                                                player = VideoPlayer(store=PlayerStore(tmp_path, snapshot_every=3))
+                                                player.create_playlist("my_playlist")
+                                                player.add_to_playlist("my_playlist", "amazing_cats_video_id")
+                                                player.add_to_playlist("my_playlist", "funny_dogs_video_id")
+                                                player.flag_video("another_cat_video_id", "dont_like_cats")
+                                                player.play_video("life_at_google_video_id")
+                                                player.pause_video()
+                                                player.close()
+                                                with open(tmp_path / "changes.log", "a") as log_file:
+                                                    log_file.write('[99, ["flag", "nothing_vi')
+
+                                                player = VideoPlayer(store=PlayerStore(tmp_path))
+                                                player.show_playing()
+                                                player.show_playlist("MY_PLAYLIST")
+                                                player.play_video("another_cat_video_id")
+                                                player.allow_video("nothing_video_id")
+                                                player.close()
+                                                out, err = capfd.readouterr()
+                                                lines = out.splitlines()[-6:]
+                                                assert "Currently playing: Life at Google (life_at_google_video_id) " \
+                                                       "[#google #career] - PAUSED" in lines[0]
+                                                assert "Amazing Cats (amazing_cats_video_id) [#cat #animal]" in lines[2]
+                                                assert "Funny Dogs (funny_dogs_video_id) [#dog #animal]" in lines[3]
+                                                assert "Cannot play video: Video is currently flagged " \
+                                                       "(reason: dont_like_cats)" in lines[4]
+                                                assert "Cannot remove flag from video: Video is not flagged" in lines[5]
+
+                                            def test_player_state_waits_for_the_library(capfd, tmp_path):
+                                                videos_path = tmp_path / "videos.txt"
+                                                write_synthetic_videos_file(videos_path, 25_000)
+                                                state_path = tmp_path / "state"
+                                                player = VideoPlayer(store=PlayerStore(state_path))
+                                                player.flag_video("amazing_cats_video_id", "dont_like_cats")
+                                                player.close()
+
+                                                player = VideoPlayer(VideoLibrary(path=videos_path), store=PlayerStore(state_path, snapshot_every=2))
+                                                player.flag_video("video_24999_id", "reason")
+                                                player.play_video("video_24998_id")
+                                                player.close()
+
+                                                library = VideoLibrary(streaming=True, path=videos_path)
+                                                player = VideoPlayer(library, store=PlayerStore(state_path))
+                                                player.show_playing()
+                                                player.close()
+                                                assert library.get_flag_reason("video_24999_id") == "reason"
+
+                                                player = VideoPlayer(store=PlayerStore(state_path))
+                                                player.play_video("amazing_cats_video_id")
+                                                out, err = capfd.readouterr()
+                                                lines = out.splitlines()
+                                                assert "Currently playing: " in lines[-2] and "(video_24998_id)" in lines[-2]
+                                                assert "Cannot play video: Video is currently flagged (reason: dont_like_cats)" in lines[-1]
+
+
+                                            def test_snapshot_is_durable_before_the_log_is_emptied(tmp_path):
+                                                import json
+                                                import os
+                                                import stat
+
+                                                store = PlayerStore(tmp_path)
+                                                store.load()
+                                                store.append(("create_playlist", "my_playlist"))
+                                                store.commit()
+                                                events = []
+                                                fsync, replace = os.fsync, os.replace
+
+                                                def recording_fsync(descriptor):
+                                                    if stat.S_ISDIR(os.fstat(descriptor).st_mode):
+                                                        events.append(("fsync directory", (tmp_path / "changes.log").stat().st_size))
+                                                    fsync(descriptor)
+
+                                                def recording_replace(source, destination):
+                                                    with open(source) as snapshot_file:
+                                                        events.append(("replace", json.load(snapshot_file)["state"]))
+                                                    replace(source, destination)
+
+                                                with mock.patch("os.fsync", recording_fsync), mock.patch("os.replace", recording_replace):
+                                                    store.snapshot({"playlists": [["my_playlist", []]]})
+                                                store.close()
+                                                assert events[0] == ("replace", {"playlists": [["my_playlist", []]]})
+                                                assert events[1][0] == "fsync directory" and events[1][1] > 0
+                                                assert len(events) == 2
+                                                assert (tmp_path / "changes.log").stat().st_size == 0
+
+
+                                            def test_session_flags_leave_the_library_alone(capfd):
+                                                library = VideoLibrary()
+                                                player = VideoPlayer(library, session_flags=True)
+                                                for video in library.get_all_videos():
+                                                    if video.video_id != "funny_dogs_video_id":
+                                                        player.flag_video(video.video_id, "not_today")
+                                                for _ in range(3):
+                                                    player.play_random_video()
+                                                    player.play_random_video("WEIGHTED")
+                                                player.allow_video("nothing_video_id")
+                                                out, err = capfd.readouterr()
+                                                lines = out.splitlines()
+                                                assert all(line == "Playing video: Funny Dogs" for line in lines[4:16:2])
+                                                assert "Successfully removed flag from video: Video about nothing" in lines[-1]
+                                                assert library.get_flags() == {}
+                                                assert VideoPlayer(library).play_video("amazing_cats_video_id") is None
+                                                assert "Playing video: Amazing Cats" in capfd.readouterr()[0]
+
+
+                                            def test_session_players_share_one_library():
+                                                player = VideoPlayer(session_flags=True)
+                                                other = VideoPlayer(session_flags=True)
+                                                assert player._video_library is VideoLibrary.shared()
+                                                assert other._video_library is VideoLibrary.shared()
+                                                assert VideoPlayer()._video_library is not VideoLibrary.shared()
+
+                                                import random
+                                                import threading
+
+                                                import pytest
+
+                                                from src.video import Video
+                                                from src.video_library import ShardedVideoLibrary, VideoLibrary, compile_catalog
 
                                                 def test_library_has_all_videos():
                                                     library = VideoLibrary()
@@ -1246,4 +4975,503 @@ class CommandParser:
                                                     assert video is not None
                                                     assert video.title == "Video about nothing"
                                                     assert video.video_id == "nothing_video_id"
-                                                    assert video.tags == ()
\ No newline at end of file
+                                                    assert video.tags == ()
+
+                                                def test_search_titles_ignores_case():
+                                                    library = VideoLibrary()
+                                                    videos = library.search_titles("CAT")
+
+                                                    assert {video.video_id for video in videos} == {
+                                                        "amazing_cats_video_id", "another_cat_video_id"}
+
+                                                def test_search_titles_long_term_needs_contiguous_match():
+                                                    library = VideoLibrary()
+
+                                                    assert [video.video_id for video in library.search_titles("at Goo")] == [
+                                                        "life_at_google_video_id"]
+                                                    assert library.search_titles("cats video") == []
+
+                                                def test_query_tags_set_algebra():
+                                                    library = VideoLibrary()
+
+                                                    def ids(expression):
+                                                        return {video.video_id for video in library.query_tags(expression)}
+
+                                                    assert ids("#CAT") == {"amazing_cats_video_id", "another_cat_video_id"}
+                                                    assert ids("#animal AND NOT #dog") == {
+                                                        "amazing_cats_video_id", "another_cat_video_id"}
+                                                    assert ids("#dog or #career") == {
+                                                        "funny_dogs_video_id", "life_at_google_video_id"}
+                                                    assert ids("NOT (#animal OR #google)") == {"nothing_video_id"}
+
+
+                                                def test_query_tags_lists_library_only_for_leftover_not(monkeypatch):
+                                                    library = VideoLibrary()
+                                                    state_type = type(library._state)
+                                                    live_ids = state_type.live_ids
+                                                    calls = []
+
+                                                    def counted_live_ids(state):
+                                                        calls.append(state)
+                                                        return live_ids(state)
+
+                                                    monkeypatch.setattr(state_type, "live_ids", counted_live_ids)
+                                                    assert {video.video_id for video in library.query_tags(
+                                                        "#animal AND NOT #dog AND NOT #cat")} == set()
+                                                    assert {video.video_id for video in library.query_tags(
+                                                        "NOT NOT #dog")} == {"funny_dogs_video_id"}
+                                                    assert len(library.query_tags("(#cat OR #dog) AND #animal")) == 3
+                                                    assert calls == []
+                                                    assert len(library.query_tags("NOT #animal")) == 2
+                                                    assert len(calls) == 1
+
+                                                def test_query_tags_invalid_expression():
+                                                    library = VideoLibrary()
+
+                                                    for expression in ("", "#cat AND", "(#cat", "#cat #dog", "OR #cat"):
+                                                        with pytest.raises(ValueError):
+                                                            library.query_tags(expression)
+
+                                                def test_remove_video_updates_indexes():
+                                                    library = VideoLibrary()
+                                                    library.remove_video("amazing_cats_video_id")
+
+                                                    assert [video.video_id for video in library.get_videos_with_tag("#cat")] == [
+                                                        "another_cat_video_id"]
+                                                    assert [video.video_id for video in library.search_titles("amaz")] == []
+
+                                                def test_compiled_catalog_matches_text_library(tmp_path):
+                                                    source = tmp_path / "videos.txt"
+                                                    source.write_text("Funny Dogs | funny_dogs_video_id | #dog , #animal\n"
+                                                                      "Old Title | amazing_cats_video_id | #old\n"
+                                                                      "Video about nothing | nothing_video_id |\n"
+                                                                      "Amazing Cats | amazing_cats_video_id | #cat , #animal\n")
+                                                    catalog = tmp_path / "videos.cat"
+                                                    compile_catalog(source, catalog)
+                                                    library = VideoLibrary(catalog)
+
+                                                    video = library.get_video("amazing_cats_video_id")
+                                                    assert video.title == "Amazing Cats"
+                                                    assert video.tags == ("#cat", "#animal")
+                                                    assert library.get_video("nothing_video_id").tags == ()
+                                                    assert library.get_video("does_not_exist") is None
+                                                    assert [video.video_id for video in library.get_all_videos()] == [
+                                                        "funny_dogs_video_id", "amazing_cats_video_id", "nothing_video_id"]
+                                                    assert sorted(video.video_id for video in library.get_videos_with_tag("#animal")) == [
+                                                        "amazing_cats_video_id", "funny_dogs_video_id"]
+
+                                                def test_compiled_catalog_rejects_other_files(tmp_path):
+                                                    other = tmp_path / "videos.txt"
+                                                    other.write_text("Funny Dogs | funny_dogs_video_id | #dog , #animal\n")
+
+                                                    with pytest.raises(ValueError):
+                                                        VideoLibrary(other)
+
+                                                def test_videos_share_interned_tags():
+                                                    library = VideoLibrary()
+                                                    cats = library.get_video("amazing_cats_video_id")
+                                                    other_cats = library.get_video("another_cat_video_id")
+
+                                                    assert not hasattr(cats, "__dict__")
+                                                    assert cats.tags is other_cats.tags
+                                                    assert Video("Title", "title_id", ["#cat", "#animal"]).tags == ("#cat", "#animal")
+
+                                                def test_streaming_load_serves_videos_once_loaded():
+                                                    library = VideoLibrary(streaming=True)
+
+                                                    assert library.wait_until_loaded(timeout=5)
+                                                    assert library.is_loaded()
+                                                    assert library.load_progress() == 1.0
+                                                    assert len(library.get_all_videos()) == 5
+                                                    assert library.get_video("funny_dogs_video_id").title == "Funny Dogs"
+
+                                                def test_reload_applies_only_the_delta(tmp_path):
+                                                    library = VideoLibrary()
+                                                    unchanged = library.get_video("funny_dogs_video_id")
+                                                    source = tmp_path / "videos.txt"
+                                                    source.write_text("Funny Dogs | funny_dogs_video_id |  #dog , #animal\n"
+                                                                      "Amazing Cats | amazing_cats_video_id |  #cat\n"
+                                                                      "Life at Google | life_at_google_video_id |  #google , #career\n"
+                                                                      "Video about nothing | nothing_video_id |\n"
+                                                                      "Brand New | brand_new_video_id | #new\n")
+
+                                                    assert library.reload(source) == (1, 1, 1)
+                                                    assert library.get_video("funny_dogs_video_id") is unchanged
+                                                    assert library.get_video("another_cat_video_id") is None
+                                                    assert library.get_video("amazing_cats_video_id").tags == ("#cat",)
+                                                    assert [video.video_id for video in library.get_videos_with_tag("#animal")] == [
+                                                        "funny_dogs_video_id"]
+                                                    assert [video.video_id for video in library.search_titles("new")] == [
+                                                        "brand_new_video_id"]
+                                                    assert library.reload(source) == (0, 0, 0)
+
+                                                def test_title_order_is_kept_up_to_date():
+                                                    library = VideoLibrary()
+                                                    assert [video.title for video in library.get_videos_by_title()] == [
+                                                        "Amazing Cats", "Another Cat Video", "Funny Dogs", "Life at Google",
+                                                        "Video about nothing"]
+                                                    version = library.version
+
+                                                    library.add_video(Video("Zebras", "amazing_cats_video_id", []))
+                                                    library.add_video(Video("Baking", "baking_video_id", []))
+                                                    library.remove_video("funny_dogs_video_id")
+
+                                                    assert library.version != version
+                                                    assert [video.title for video in library.get_videos_by_title()] == [
+                                                        "Another Cat Video", "Baking", "Life at Google", "Video about nothing",
+                                                        "Zebras"]
+
+                                                def test_collection_protocol():
+                                                    library = VideoLibrary()
+
+                                                    assert len(library) == 5
+                                                    assert "funny_dogs_video_id" in library
+                                                    assert "does_not_exist" not in library
+                                                    assert [video.video_id for video in library] == [
+                                                        video.video_id for video in library.get_all_videos()]
+                                                    assert [video.video_id for video in library.get_videos(1, 2)] == [
+                                                        "amazing_cats_video_id", "another_cat_video_id"]
+                                                    assert len(library.get_videos(4)) == 1
+
+                                                def test_flagged_videos_are_filtered():
+                                                    library = VideoLibrary()
+                                                    version = library.version
+
+                                                    assert library.flag_video("amazing_cats_video_id", "dont_like_cats")
+                                                    assert not library.flag_video("does_not_exist", "reason")
+                                                    assert library.version != version
+                                                    assert library.get_flag_reason("amazing_cats_video_id") == "dont_like_cats"
+                                                    assert library.get_flags() == {"amazing_cats_video_id": "dont_like_cats"}
+                                                    assert {video.video_id for video in library.search_titles("cat", exclude_flagged=True)} == {
+                                                        "another_cat_video_id"}
+                                                    assert len(library.search_titles("cat")) == 2
+                                                    assert library.get_videos_with_tag("#cat", exclude_flagged=True) == [
+                                                        library.get_video("another_cat_video_id")]
+
+                                                    assert library.allow_video("amazing_cats_video_id")
+                                                    assert not library.allow_video("amazing_cats_video_id")
+                                                    assert len(library.search_titles("cat", exclude_flagged=True)) == 2
+
+                                                def test_random_video_skips_flagged_videos():
+                                                    library = VideoLibrary()
+                                                    for video_id in ["funny_dogs_video_id", "amazing_cats_video_id",
+                                                                     "another_cat_video_id", "life_at_google_video_id"]:
+                                                        library.flag_video(video_id, "reason")
+
+                                                    assert {library.random_video().video_id for _ in range(20)} == {"nothing_video_id"}
+                                                    library.remove_video("nothing_video_id")
+                                                    assert library.random_video() is None
+                                                    library.allow_video("amazing_cats_video_id")
+                                                    assert library.random_video().video_id == "amazing_cats_video_id"
+
+                                                def test_weighted_random_video_follows_weights(tmp_path):
+                                                    library = VideoLibrary()
+                                                    videos_file = tmp_path / "videos.txt"
+                                                    videos_file.write_text(
+                                                        "Amazing Cats | amazing_cats_video_id | #cat , #animal | 3\n"
+                                                        "Funny Dogs | funny_dogs_video_id | #dog , #animal | 1\n"
+                                                        "Life at Google | life_at_google_video_id | #google |\n")
+                                                    library.reload(videos_file)
+                                                    rng = random.Random(0)
+
+                                                    assert library.get_weight("amazing_cats_video_id") == 3.0
+                                                    assert library.get_weight("life_at_google_video_id") == 1.0
+                                                    draws = [library.weighted_random_video(rng).video_id for _ in range(5000)]
+                                                    assert 0.55 < draws.count("amazing_cats_video_id") / len(draws) < 0.65
+
+                                                    library.flag_video("amazing_cats_video_id", "reason")
+                                                    assert library.set_tag_weight("#dog", 9) == 1
+                                                    draws = [library.weighted_random_video(rng).video_id for _ in range(5000)]
+                                                    assert "amazing_cats_video_id" not in draws
+                                                    assert 0.85 < draws.count("funny_dogs_video_id") / len(draws) < 0.95
+                                                    with pytest.raises(ValueError):
+                                                        library.set_weight("funny_dogs_video_id", 0)
+
+                                                def test_readers_see_published_snapshots():
+                                                    library = VideoLibrary()
+                                                    videos = iter(library)
+                                                    version = library.version
+                                                    library.add_video(Video("Baking", "baking_video_id", ["#food"]))
+                                                    library.flag_video("amazing_cats_video_id", "reason")
+
+                                                    assert len(list(videos)) == 5
+                                                    assert library.version == version + 2
+                                                    assert len(library) == 6
+
+                                                    stopped = threading.Event()
+
+                                                    def write():
+                                                        while not stopped.is_set():
+                                                            library.flag_video("funny_dogs_video_id", "reason")
+                                                            library.allow_video("funny_dogs_video_id")
+
+                                                    writer = threading.Thread(target=write)
+                                                    writer.start()
+                                                    try:
+                                                        for _ in range(2000):
+                                                            assert len(library.get_videos_with_tag("#animal")) == 3
+                                                            assert len(library.search_titles("cat", exclude_flagged=True)) == 1
+                                                    finally:
+                                                        stopped.set()
+                                                        writer.join()
+
+                                                def test_ingest_matches_loading_row_by_row(tmp_path):
+                                                    rows = [(f"Video {number % 50}", f"video_{number % 250}_id",
+                                                             [f"#tag{number % 7}"]) for number in range(300)]
+                                                    rows.append(("Amazing Dogs", "amazing_cats_video_id", ["#dog"]))
+                                                    videos_file = tmp_path / "videos.txt"
+                                                    videos_file.write_text("".join(f"{title} | {video_id} | {','.join(tags)}\n"
+                                                                                   for title, video_id, tags in rows))
+                                                    serial = VideoLibrary()
+                                                    for title, video_id, tags in rows:
+                                                        serial.add_video(Video(title, video_id, tags))
+                                                    parallel = VideoLibrary()
+                                                    parallel.ingest(videos_file, workers=2)
+
+                                                    assert [(video.video_id, video.title, video.tags) for video in parallel] == [
+                                                        (video.video_id, video.title, video.tags) for video in serial]
+                                                    for term in ("cat", "dogs", "video 4", "o"):
+                                                        assert ({video.video_id for video in parallel.search_titles(term)}
+                                                                == {video.video_id for video in serial.search_titles(term)})
+                                                    assert ({video.video_id for video in parallel.get_videos_with_tag("#tag3")}
+                                                            == {video.video_id for video in serial.get_videos_with_tag("#tag3")})
+
+
+                                                def test_ingest_after_listing_and_completing(tmp_path):
+                                                    videos_file = tmp_path / "videos.txt"
+                                                    videos_file.write_text("".join(f"Video {number} | video_{number % 50}_id | #tag\n"
+                                                                                   for number in range(100)))
+                                                    for prepare in (VideoLibrary.get_videos_by_title,
+                                                                    lambda library: library.complete("video")):
+                                                        library = VideoLibrary()
+                                                        prepare(library)
+                                                        library.ingest(videos_file, workers=2)
+
+                                                        assert len(library) == 55
+                                                        assert library.get_video("video_7_id").title == "Video 57"
+                                                        listed = library.get_videos_by_title()
+                                                        assert [video.title for video in listed[:3]] == [
+                                                            "Amazing Cats", "Another Cat Video", "Funny Dogs"]
+                                                        assert [video.title for video in listed[-2:]] == ["Video 99", "Video about nothing"]
+                                                        assert library.complete("video_7_i") == [("video_7_id", "video_7_id")]
+
+                                                def test_sharded_library_matches_single_library():
+                                                    library = VideoLibrary()
+                                                    sharded = ShardedVideoLibrary(shards=3)
+                                                    try:
+                                                        def rows(videos):
+                                                            return [(video.video_id, video.title, video.tags) for video in videos]
+
+                                                        assert len(sharded) == 5
+                                                        assert rows([sharded.get_video("funny_dogs_video_id")]) == rows(
+                                                            [library.get_video("funny_dogs_video_id")])
+                                                        assert sharded.get_video("does_not_exist") is None
+                                                        assert rows(sharded.get_videos_by_title()) == rows(library.get_videos_by_title())
+                                                        version = sharded.version
+                                                        assert sharded.flag_video("amazing_cats_video_id", "reason")
+                                                        assert sharded.version != version
+                                                        assert sharded.get_flags() == {"amazing_cats_video_id": "reason"}
+                                                        assert rows(sharded.search_titles("cat", exclude_flagged=True)) == [
+                                                            ("another_cat_video_id", "Another Cat Video", ("#cat", "#animal"))]
+                                                        assert rows(sharded.get_videos_with_tag("#ANIMAL")) == rows(sorted(
+                                                            library.get_videos_with_tag("#animal"), key=lambda video: video.title))
+                                                        assert rows(sharded.fuzzy_search_titles("anothr cat")) == rows(
+                                                            library.fuzzy_search_titles("anothr cat"))
+                                                        assert sharded.complete("a", limit=3) == library.complete("a", limit=3)
+                                                        with pytest.raises(ValueError):
+                                                            sharded.fuzzy_search_titles("cats", max_distance=-1)
+                                                        assert len(sharded) == 5
+                                                        assert sharded.random_video().video_id != "amazing_cats_video_id"
+                                                    finally:
+                                                        sharded.close()
+
+                                                def test_iter_search_titles_is_sorted_and_limited():
+                                                    library = VideoLibrary()
+                                                    for number in range(100):
+                                                        library.add_video(Video(f"Clip {99 - number:02d}", f"clip_{number}_id", ["#clip"]))
+                                                    library.flag_video("clip_99_id", "reason")
+
+                                                    assert [video.title for video in library.iter_search_titles("clip", limit=3)] == [
+                                                        "Clip 00", "Clip 01", "Clip 02"]
+                                                    assert [video.title for video in library.iter_search_titles(
+                                                        "clip", exclude_flagged=True, limit=2)] == ["Clip 01", "Clip 02"]
+                                                    assert [video.title for video in library.iter_search_titles("cat")] == [
+                                                        "Amazing Cats", "Another Cat Video"]
+                                                    titles = [video.title for video in library.iter_videos_with_tag("#CLIP")]
+                                                    assert titles == sorted(titles) and len(titles) == 100
+                                                    assert [video.title for video in library.iter_videos_with_tag(
+                                                        "#clip", exclude_flagged=True, limit=2)] == ["Clip 01", "Clip 02"]
+                                                    library.flag_video("amazing_cats_video_id", "reason")
+                                                    assert [video.title for video in library.iter_search_titles(
+                                                        "cat", exclude_flagged=True)] == ["Another Cat Video"]
+                                                    assert [video.title for video in library.iter_videos_with_tag(
+                                                        "#cat", exclude_flagged=True)] == ["Another Cat Video"]
+
+                                                def test_fuzzy_search_titles_ranks_by_typos():
+                                                    library = VideoLibrary()
+                                                    library.add_video(Video("Amazing Cars", "amazing_cars_id", ["#car"]))
+
+                                                    assert [video.video_id for video in library.fuzzy_search_titles("amazng cats")] == [
+                                                        "amazing_cats_video_id", "amazing_cars_id"]
+                                                    assert [video.video_id for video in library.fuzzy_search_titles("AMAZNG CATS", max_distance=1)] == [
+                                                        "amazing_cats_video_id"]
+                                                    library.flag_video("amazing_cats_video_id", "reason")
+                                                    assert [video.video_id for video in library.fuzzy_search_titles("amazng cats", exclude_flagged=True)] == [
+                                                        "amazing_cars_id"]
+                                                    assert library.fuzzy_search_titles("dgo") == []
+                                                    with pytest.raises(ValueError):
+                                                        library.fuzzy_search_titles("cats", max_distance=-1)
+
+                                                def test_complete_stays_in_sync():
+                                                    library = VideoLibrary()
+                                                    assert library.complete("AMAZ") == [
+                                                        ("Amazing Cats", "amazing_cats_video_id"),
+                                                        ("amazing_cats_video_id", "amazing_cats_video_id")]
+                                                    library.add_video(Video("Amazing Dogs", "dogs_2_id", ["#dog"]))
+                                                    library.remove_video("amazing_cats_video_id")
+                                                    assert library.complete("amaz") == [("Amazing Dogs", "dogs_2_id")]
+                                                    assert library.complete("", limit=2) == [
+                                                        ("Amazing Dogs", "dogs_2_id"), ("Another Cat Video", "another_cat_video_id")]
+
+                                                def test_videos_built_in_threads_keep_their_tags():
+                                                    mismatches = []
+
+                                                    def build(thread):
+                                                        for number in range(200):
+                                                            tags = (f"#thread{thread}_{number}", "#shared")
+                                                            if Video("Title", f"id_{thread}_{number}", tags).tags != tags:
+                                                                mismatches.append(tags)
+
+                                                    threads = [threading.Thread(target=build, args=(thread,)) for thread in range(8)]
+                                                    for thread in threads:
+                                                        thread.start()
+                                                    for thread in threads:
+                                                        thread.join()
+                                                    assert mismatches == []
+
+                                                def test_short_terms_are_answered_from_trigram_keys():
+                                                    library = VideoLibrary()
+                                                    library.add_video(Video("Go", "go_video_id", []))
+
+                                                    assert all(len(key) == 3 or key == "go" for key in library._state.title_index)
+                                                    assert {video.video_id for video in library.search_titles("GO")} == {
+                                                        "go_video_id", "life_at_google_video_id"}
+                                                    assert {video.video_id for video in library.search_titles("oo")} == {
+                                                        "life_at_google_video_id"}
+                                                    assert [video.video_id for video in library.search_titles("t g")] == [
+                                                        "life_at_google_video_id"]
+
+                                                def test_writes_share_what_they_do_not_change():
+                                                    library = VideoLibrary()
+                                                    state = library._state
+
+                                                    library.flag_video("funny_dogs_video_id", "reason")
+                                                    assert library._state is state
+                                                    library.add_video(Video("Baking", "baking_video_id", ["#animal"]))
+                                                    assert library._state.rows is state.rows
+                                                    assert library._state.tag_index["#animal"] is state.tag_index["#animal"]
+                                                    assert state.video("baking_video_id") is None
+                                                    assert len(state.visible(state.tag_index["#animal"])) == 3
+
+                                                    with pytest.raises(ValueError):
+                                                        with library._writing():
+                                                            library.add_video(Video("Temporary", "temporary_video_id", ["#animal"]))
+                                                            raise ValueError("write failed")
+                                                    library.add_video(Video("Pasta", "pasta_video_id", []))
+                                                    assert library.get_video("temporary_video_id") is None
+                                                    assert library.search_titles("temporary") == []
+                                                    assert len(library.get_videos_with_tag("#animal")) == 4
+                                                    assert library.get_flags() == {"funny_dogs_video_id": "reason"}
+
+                                                def test_title_order_writes_leave_published_orders_alone():
+                                                    library = VideoLibrary()
+                                                    titles = [video.title for video in library.get_videos_by_title()]
+                                                    state = library._state
+
+                                                    library.add_video(Video("Baking", "baking_video_id", []))
+                                                    library.remove_video("funny_dogs_video_id")
+
+                                                    assert [title for title, _, _ in state.title_order] == titles
+                                                    assert [title for title, _, _ in library._state.title_order] == [
+                                                        "Amazing Cats", "Another Cat Video", "Baking", "Life at Google",
+                                                        "Video about nothing"]
+
+                                                def test_watch_skips_and_reports_a_bad_version(tmp_path):
+                                                    source = tmp_path / "videos.txt"
+                                                    source.write_text("Funny Dogs | funny_dogs_video_id | #dog\n")
+                                                    library = VideoLibrary(path=source)
+                                                    library.wait_until_loaded()
+                                                    reloads = []
+                                                    staged = tmp_path / "staged.txt"
+                                                    reload = library.reload
+                                                    library.reload = lambda: reloads.append(source.read_text()) or reload()
+
+                                                    def replace(text):
+                                                        # Written aside and renamed, so the watcher never sees it half written.
+                                                        staged.write_text(text)
+                                                        staged.replace(source)
+
+                                                    def wait_for(condition):
+                                                        for _ in range(500):
+                                                            if condition():
+                                                                return True
+                                                            threading.Event().wait(0.01)
+                                                        return False
+
+                                                    library.watch(interval=0.01)
+                                                    # Let the watcher note the current version before it changes.
+                                                    threading.Event().wait(0.1)
+                                                    try:
+                                                        replace("Funny Dogs | funny_dogs_video_id | #dog | heavy\n")
+                                                        assert wait_for(lambda: library.watch_error() is not None)
+                                                        assert isinstance(library.watch_error(), ValueError)
+                                                        threading.Event().wait(0.1)
+                                                        assert len(reloads) == 1
+                                                        replace("Funny Dogs | funny_dogs_video_id | #dog\n"
+                                                                "Amazing Cats | amazing_cats_video_id | #cat\n")
+                                                        assert wait_for(lambda: library.get_video("amazing_cats_video_id") is not None)
+                                                        assert library.watch_error() is None
+                                                        assert len(reloads) == 2
+                                                    finally:
+                                                        library.stop_watching()
+
+                                                def test_listing_lines_rebuild_only_the_changed_video():
+                                                    library = VideoLibrary()
+                                                    lines = library.get_listing_lines()
+                                                    assert lines[0] == "Amazing Cats (amazing_cats_video_id) [#cat #animal]"
+                                                    assert library.flag_video("funny_dogs_video_id", "too loud")
+                                                    flagged = library.get_listing_lines()
+                                                    assert flagged[2] == ("Funny Dogs (funny_dogs_video_id) [#dog #animal]"
+                                                                          " - FLAGGED (reason: too loud)")
+                                                    assert all(old is new for old, new in zip(lines, flagged) if old is not lines[2])
+                                                    assert library.allow_video("funny_dogs_video_id")
+                                                    library.add_video(Video("Amazing Cats", "amazing_cats_video_id", ["#cat"]))
+                                                    assert library.get_listing_lines()[:3] == [
+                                                        "Amazing Cats (amazing_cats_video_id) [#cat]",
+                                                        "Another Cat Video (another_cat_video_id) [#cat #animal]",
+                                                        "Funny Dogs (funny_dogs_video_id) [#dog #animal]"]
+
+                                                def test_random_video_draws_from_a_consistent_eligible_list():
+                                                    library = VideoLibrary()
+                                                    removers = []
+
+                                                    class RemovingRandom:
+                                                        """Removes the video it is about to draw from another thread."""
+
+                                                        def choice(self, dense_ids):
+                                                            position = len(dense_ids) - 1
+                                                            video_id = library._state.rows[dense_ids[position]].video_id
+                                                            remover = threading.Thread(target=library.remove_video, args=(video_id,))
+                                                            removers.append(remover)
+                                                            remover.start()
+                                                            # The removal waits for the draw to finish, or is done by now.
+                                                            remover.join(0.1)
+                                                            return dense_ids[position]
+
+                                                    draws = []
+                                                    for _ in range(5):
+                                                        draws.append(library.random_video(RemovingRandom()))
+                                                        removers[-1].join()
+                                                    assert None not in draws
+                                                    assert len(set(draws)) == 5
+                                                    assert library.random_video() is None
\ No newline at end of file